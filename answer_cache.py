@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from reformulation import normalize_question
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# 0 = sadece normalize edilmiş birebir eşleşme; örn. 0.95 ile embedding benzerliği de denenir
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+
+class AnswerCache:
+    # Anahtar: (ingest sürümü, kapsam, normalize soru). Yeni bir upload sürümü artırınca eski girdiler düşer.
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY, embed_query=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embed_query = embed_query
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.similarity_threshold > 0 and self.embed_query is not None
+
+    def _sync_version(self, version: int):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def _expired(self, entry: dict) -> bool:
+        return time.time() - entry["created_at"] > self.ttl
+
+    def _embedding(self, question: str):
+        vector = np.asarray(self.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, question: str, version: int, scope: str = ""):
+        key = (scope, normalize_question(question))
+        with self.lock:
+            self._sync_version(version)
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry["value"]
+            candidates = [(k, e) for k, e in self.entries.items()
+                          if k[0] == scope and e["embedding"] is not None and not self._expired(e)]
+        if self.semantic_enabled and candidates:
+            query = self._embedding(question)
+            matrix = np.stack([e["embedding"] for _, e in candidates])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                best_key, best_entry = candidates[best]
+                with self.lock:
+                    if best_key in self.entries:
+                        self.entries.move_to_end(best_key)
+                    self.hits_semantic += 1
+                return best_entry["value"]
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, question: str, version: int, value: dict, scope: str = ""):
+        embedding = self._embedding(question) if self.semantic_enabled else None
+        key = (scope, normalize_question(question))
+        with self.lock:
+            if self.version is not None and version < self.version:
+                # İstek sürerken yeni bir ingest tamamlandı; eski sürümün cevabını saklama
+                return
+            self._sync_version(version)
+            self.entries[key] = {"value": value, "embedding": embedding, "created_at": time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "entries": len(self.entries),
+            "version": self.version,
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_exact + self.hits_semantic) / total, 4) if total else 0.0,
+        }
@@ -1,13 +1,83 @@
 import streamlit as st
-import requests, os, base64
+import requests, os, time, json
+from uuid import uuid4
+from urllib.parse import quote
 from PIL import Image
 
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://fastapi:8000")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_POLL_TIMEOUT = float(os.getenv("JOB_POLL_TIMEOUT", "900"))
 st.set_page_config(page_title="Dinamik Öğrenme Yolu", page_icon="📚", layout="wide")
 
+def new_request_id():
+    # Sunucu loglarında aynı kimlikle aranabilir (X-Request-ID)
+    return uuid4().hex[:16]
+
+def job_fraction(job):
+    p = job["progress"]
+    if job["status"] in ("done", "failed"):
+        return 1.0
+    if p.get("chunks_total"):
+        return 0.5 + 0.5 * min(1.0, p["points_upserted"] / p["chunks_total"])
+    if p.get("pages_total"):
+        return 0.5 * min(1.0, p["pages_parsed"] / p["pages_total"])
+    return 0.0
+
+def wait_for_job(job_id):
+    # Sunucudaki ingest işini ilerleme çubuğuyla takip et
+    bar = st.progress(0.0, text="Kuyrukta...")
+    deadline = time.time() + JOB_POLL_TIMEOUT
+    while time.time() < deadline:
+        response = requests.get(f"{FASTAPI_URL}/jobs/{job_id}", timeout=10)
+        response.raise_for_status()
+        job = response.json()
+        p = job["progress"]
+        bar.progress(job_fraction(job), text=(
+            f"{job['status']} · sayfa {p['pages_parsed']}/{p['pages_total']} · "
+            f"embed {p['chunks_embedded']}/{p['chunks_total']} · upsert {p['points_upserted']}"
+        ))
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(JOB_POLL_INTERVAL)
+    raise TimeoutError("İş zamanında tamamlanmadı")
+
+@st.cache_data(max_entries=100, show_spinner=False)
+def fetch_graph(graph_url):
+    # Grafik id'si içeriğin hash'i; aynı URL her zaman aynı PNG'dir
+    response = requests.get(f"{FASTAPI_URL}{graph_url}", timeout=30)
+    response.raise_for_status()
+    return response.content
+
+def show_graph(graph_url):
+    try:
+        st.image(fetch_graph(graph_url), use_container_width=True)
+    except Exception as e:
+        st.warning(f"Grafik yüklenemedi: {e}")
+
+def fetch_documents():
+    response = requests.get(f"{FASTAPI_URL}/documents", timeout=10)
+    response.raise_for_status()
+    return response.json()["documents"]
+
+def iter_sse(response):
+    # text/event-stream yanıtını (olay, veri) çiftlerine ayır
+    event, data = "message", []
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 # Session state başlatma
 if 'page' not in st.session_state:
     st.session_state.page = "home"
+# Her tarayıcı oturumu sunucuda kendi sohbet geçmişini kullanır
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid4().hex
 
 # Sidebar navigasyon
 with st.sidebar:
@@ -26,16 +96,51 @@ with st.sidebar:
         st.header("📁 PDF Yükleme")
         uploaded_file = st.file_uploader("PDF seçin", type=['pdf'])
         if st.button("📤 Dosya Yükle") and uploaded_file:
-            files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
-            response = requests.post(f"{FASTAPI_URL}/upload-pdf", files=files)
-            if response.status_code==200:
+            # UploadedFile dosya nesnesi olarak verilir, getvalue() ile ikinci bir kopya oluşturulmaz
+            uploaded_file.seek(0)
+            files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
+            request_id = new_request_id()
+            response = requests.post(f"{FASTAPI_URL}/upload-pdf", files=files, headers={"X-Request-ID": request_id})
+            if response.status_code in (200, 202):
                 result=response.json()
-                st.success(result["message"])
-                with st.expander("📊 Dosya Detayları"):
-                    st.write(f"**Dosya:** {result['filename']}")
-                    st.write(f"**Boyut:** {result['size_bytes']/1024:.2f} KB")
+                st.info(result["message"])
+                try:
+                    job = wait_for_job(result["job_id"])
+                    if job["status"] == "done":
+                        st.success(f"{result['filename']} başarıyla yüklendi ve işlendi")
+                        with st.expander("📊 Dosya Detayları"):
+                            st.write(f"**Dosya:** {result['filename']}")
+                            st.write(f"**Boyut:** {result['size_bytes']/1024:.2f} KB")
+                            st.write(f"**Yeni chunk:** {job['result']['chunks_added']}")
+                            if job['result'].get('superseded'):
+                                st.write(f"**Yerine geçtiği sürüm:** {', '.join(job['result']['superseded'])}")
+                    else:
+                        st.error(f"PDF işlenemedi: {job['error']}")
+                except Exception as e:
+                    st.error(f"İş takibi hatası: {e}")
             else:
-                st.error(response.text)
+                st.error(f"{response.text} (istek: {request_id})")
+
+        st.markdown("---")
+        st.header("📚 Dokümanlar")
+        try:
+            st.session_state.documents = fetch_documents()
+        except Exception as e:
+            st.session_state.documents = []
+            st.warning(f"Doküman listesi alınamadı: {e}")
+        if not st.session_state.documents:
+            st.caption("Henüz indekslenmiş doküman yok")
+        for doc in st.session_state.documents:
+            col_name, col_delete = st.columns([5, 1])
+            icon = "🖼️" if doc["doc_type"] == "image" else "📄"
+            col_name.caption(f"{icon} {doc['name']} · {doc['chunk_count']} chunk · {doc['size_bytes']/1024:.0f} KB")
+            if col_delete.button("🗑️", key=f"delete_{doc['stored_as']}", help="İndeksten ve diskten sil"):
+                request_id = new_request_id()
+                response = requests.delete(f"{FASTAPI_URL}/documents/{quote(doc['stored_as'])}", timeout=60,
+                                           headers={"X-Request-ID": request_id})
+                if response.status_code == 200:
+                    st.rerun()
+                st.error(f"{response.text} (istek: {request_id})")
 
 # ============================================
 # ANA SAYFA - Tanıtım
@@ -244,14 +349,22 @@ elif st.session_state.page == "assistant":
     # Görsel analiz butonu
     if uploaded_image:
         if st.button("🔍 Görseli Analiz Et", type="primary", use_container_width=True):
-            files = {"file": (uploaded_image.name, uploaded_image.getvalue(), uploaded_image.type)}
+            uploaded_image.seek(0)
+            files = {"file": (uploaded_image.name, uploaded_image, uploaded_image.type)}
             
             with st.spinner("Görsel analiz ediliyor..."):
                 try:
-                    response = requests.post(f"{FASTAPI_URL}/upload-image", files=files, timeout=60)
-                    
-                    if response.status_code == 200:
+                    request_id = new_request_id()
+                    response = requests.post(f"{FASTAPI_URL}/upload-image", files=files, timeout=60,
+                                             headers={"X-Request-ID": request_id})
+                    if response.status_code in (200, 202):
+                        # 200: aynı görsel daha önce analiz edilmiş, sonuç doğrudan döner
                         data = response.json()
+                        if response.status_code == 202:
+                            job = wait_for_job(data["job_id"])
+                            if job["status"] != "done":
+                                raise RuntimeError(job["error"])
+                            data = job["result"]
                         st.success(data.get("message", "Görsel başarıyla işlendi!"))
                         
                         # Analiz sonucunu göster
@@ -260,11 +373,11 @@ elif st.session_state.page == "assistant":
                             st.info(data["analysis"])
                         
                         # Grafik varsa göster
-                        if data.get("graph_image"):
+                        if data.get("graph_url"):
                             st.markdown("### 📊 Grafik")
-                            st.image(base64.b64decode(data["graph_image"]), use_container_width=True)
+                            show_graph(data["graph_url"])
                     else:
-                        st.error(f"Hata: {response.status_code} - {response.text}")
+                        st.error(f"Hata: {response.status_code} - {response.text} (istek: {request_id})")
                         
                 except Exception as e:
                     st.error(f"İstek hatası: {str(e)}")
@@ -278,6 +391,21 @@ elif st.session_state.page == "assistant":
     if "messages" not in st.session_state:
         st.session_state.messages=[]
 
+    if st.button("🧹 Yeni Sohbet"):
+        try:
+            requests.delete(f"{FASTAPI_URL}/sessions/{st.session_state.session_id}", timeout=10)
+        except Exception:
+            pass
+        st.session_state.session_id = uuid4().hex
+        st.session_state.messages = []
+        st.rerun()
+
+    # Boş bırakılırsa tüm dokümanlarda aranır
+    selected_documents = st.multiselect(
+        "🔎 Sadece şu dokümanlarda ara",
+        sorted({d["name"] for d in st.session_state.get("documents", [])}),
+    )
+
     for m in st.session_state.messages:
         with st.chat_message(m["role"]):
             st.markdown(m["content"])
@@ -290,20 +418,36 @@ elif st.session_state.page == "assistant":
         with st.chat_message("assistant"):
             msg_placeholder = st.empty()
             full_response = ""
+            sources = ""
+            request_id = new_request_id()
             try:
-                payload = {"name": prompt}
-                response = requests.post(f"{FASTAPI_URL}/message", json=payload, timeout=60)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    full_response = result.get("text", "")
-                    msg_placeholder.markdown(full_response)
-                    
-                    # Eğer grafik varsa göster
-                    if result.get("graph_image"):
-                        st.image(base64.b64decode(result["graph_image"]), use_container_width=True)
-                else:
-                    msg_placeholder.markdown(f"❌ Hata: {response.status_code}")
+                payload = {"name": prompt, "session_id": st.session_state.session_id}
+                if selected_documents:
+                    payload["documents"] = selected_documents
+                with requests.post(f"{FASTAPI_URL}/message/stream", json=payload, stream=True, timeout=(10, 120),
+                                   headers={"X-Request-ID": request_id}) as response:
+                    if response.status_code == 200:
+                        response.encoding = "utf-8"
+                        for event, data in iter_sse(response):
+                            if event == "sources":
+                                sources = ", ".join(
+                                    f"{d['source']} (s. {d['page'] + 1})" if d.get("page") is not None else d["source"]
+                                    for d in data
+                                )
+                            elif event == "token":
+                                full_response += data["text"]
+                                msg_placeholder.markdown(full_response + "▌")
+                            elif event == "graph":
+                                show_graph(data["graph_url"])
+                            elif event == "done":
+                                full_response = data["text"]
+                                msg_placeholder.markdown(full_response)
+                                if sources:
+                                    st.caption(f"📎 Kaynaklar: {sources}")
+                            elif event == "error":
+                                msg_placeholder.markdown(f"❌ Hata: {data['detail']} (istek: {request_id})")
+                    else:
+                        msg_placeholder.markdown(f"❌ Hata: {response.status_code} (istek: {request_id})")
             except Exception as e:
                 msg_placeholder.markdown(f"❌ Hata: {e}")
         
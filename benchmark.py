@@ -0,0 +1,504 @@
+# Çevrimdışı benchmark / yük testi.
+# Gerçek feed.py uygulamasını (uvicorn, HTTP) ve ingest pipeline'ını Gemini kotası harcamadan çalıştırır:
+# deterministik sahte chat ve embedding modelleri, Qdrant'ın process içi local modu ve üretilmiş PDF/görsel korpusu.
+#
+#   python benchmark.py --pdfs 5 --pages 20 --images 4 --requests 200 --concurrency 1,4,16
+#   python benchmark.py --compare bench_results/onceki.json
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import socket
+import asyncio
+import hashlib
+import argparse
+import resource
+import tempfile
+import warnings
+import threading
+import subprocess
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_OUTPUT_DIR = "bench_results"
+
+TOPICS = [
+    ("türev", "Bir fonksiyonun türevi, x noktasındaki anlık değişim hızını verir. f(x) = x^2 için f'(x) = 2x olur."),
+    ("integral", "Belirli integral eğri altındaki alanı hesaplar. x^2'nin 0 ile 1 arasındaki integrali 1/3'tür."),
+    ("limit", "Limit, x bir değere yaklaşırken fonksiyonun yaklaştığı değerdir. sin(x)/x'in 0'daki limiti 1'dir."),
+    ("matris", "Matris çarpımında satırlar sütunlarla çarpılıp toplanır. Birim matris çarpmada etkisizdir."),
+    ("olasılık", "Bağımsız iki olayın birlikte olma olasılığı olasılıkların çarpımıdır."),
+    ("seri", "Geometrik seri |r| < 1 için a / (1 - r) toplamına yakınsar."),
+    ("vektör", "İki vektörün iç çarpımı, boyların ve aradaki açının kosinüsünün çarpımıdır."),
+    ("logaritma", "log(ab) = log(a) + log(b) özelliği çarpımı toplamaya çevirir."),
+]
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: list) -> dict:
+    ms = [value * 1000 for value in latencies]
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 2) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms, default=0.0), 2),
+    }
+
+
+def peak_rss_mb() -> dict:
+    # Linux'ta ru_maxrss KB; children: parse/OCR/grafik process havuzları
+    to_mb = 1 / 1024 if sys.platform != "darwin" else 1 / (1024 * 1024)
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * to_mb, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * to_mb, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ""
+
+
+def generate_pdfs(directory: str, count: int, pages: int, seed: int) -> list:
+    import pymupdf
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        doc = pymupdf.open()
+        for page_number in range(pages):
+            page = doc.new_page()
+            topic, sentence = TOPICS[(index + page_number) % len(TOPICS)]
+            lines = [f"Bölüm {page_number + 1}: {topic}"]
+            for _ in range(30):
+                lines.append(f"{sentence} Örnek {rng.randint(1, 999)}: x = {rng.randint(-50, 50)} için hesaplayın.")
+            page.insert_textbox(pymupdf.Rect(50, 50, 545, 800), "\n".join(lines), fontsize=9)
+        path = os.path.join(directory, f"bench_{index:03d}.pdf")
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def generate_images(directory: str, count: int, seed: int) -> list:
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        img = Image.new("RGB", (1600, 1200), "white")
+        draw = ImageDraw.Draw(img)
+        # Her görsel farklı bloklar içerir ki perceptual hash'leri ayrışsın
+        for _ in range(12):
+            x, y = rng.randint(0, 1400), rng.randint(0, 1000)
+            draw.rectangle([x, y, x + rng.randint(50, 200), y + rng.randint(50, 200)],
+                           fill=tuple(rng.randint(0, 200) for _ in range(3)))
+        topic, sentence = TOPICS[index % len(TOPICS)]
+        draw.text((60, 60), f"Soru {index + 1} ({topic}): {sentence}", fill="black")
+        path = os.path.join(directory, f"bench_{index:03d}.jpg")
+        img.save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def questions(count: int, repeat_ratio: float, seed: int, label: str = "") -> list:
+    # label her eşzamanlılık seviyesinde farklıdır; önceki seviyenin cevapları cache'ten dönmez,
+    # cache isabetleri sadece --repeat-ratio ile seviye içinde oluşur
+    rng = random.Random(seed)
+    result = []
+    for index in range(count):
+        topic, _ = TOPICS[index % len(TOPICS)]
+        if result and rng.random() < repeat_ratio:
+            result.append(rng.choice(result))
+        elif index % 10 == 9:
+            result.append(f"{topic} için grafik çizer misin? ({label}{index})")
+        else:
+            result.append(f"{topic} konusunu örnekle açıklar mısın? ({label}{index})")
+    return result
+
+
+def build_fakes(args):
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.embeddings.fake import DeterministicFakeEmbedding
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    class BenchEmbeddings(Embeddings):
+        # Aynı metin her zaman aynı vektör; ağ gecikmesi latency ile taklit edilir
+        def __init__(self, size: int, latency: float):
+            self.inner = DeterministicFakeEmbedding(size=size)
+            self.latency = latency
+
+        def embed_documents(self, texts):
+            if self.latency:
+                time.sleep(self.latency)
+            return self.inner.embed_documents(texts)
+
+        def embed_query(self, text):
+            if self.latency:
+                time.sleep(self.latency)
+            return self.inner.embed_query(text)
+
+    class BenchChatModel(BaseChatModel):
+        # Soruya göre deterministik cevap; ilk token gecikmesi ve token başına gecikme ayarlanabilir
+        latency: float = 0.0
+        token_delay: float = 0.0
+
+        @property
+        def _llm_type(self) -> str:
+            return "bench-fake"
+
+        def _answer(self, messages) -> str:
+            last = messages[-1].content
+            if isinstance(last, list):
+                return "Görselde bir türev sorusu var. f(x) = x^2 ise f'(x) = 2x.\nGRAPH: f(x) = x**2, [-3, 3]"
+            if "reformulate" in str(messages[0].content).lower():
+                return str(last)
+            digest = hashlib.sha256(str(last).encode()).digest()
+            topic, sentence = TOPICS[digest[0] % len(TOPICS)]
+            words = [f"{topic.capitalize()} hakkında:"] + (sentence.split() * (2 + digest[1] % 4))
+            answer = " ".join(words)
+            if "grafik" in str(last):
+                answer += "\nGRAPH: f(x) = sin(x) + x/3, [-2*pi, 2*pi]"
+            return answer
+
+        def _usage(self, messages, answer: str) -> dict:
+            prompt_tokens = sum(len(str(m.content)) for m in messages) // 4 + 1
+            output_tokens = len(answer) // 4 + 1
+            return {"input_tokens": prompt_tokens, "output_tokens": output_tokens,
+                    "total_tokens": prompt_tokens + output_tokens}
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            answer = self._answer(messages)
+            message = AIMessage(content=answer, usage_metadata=self._usage(messages, answer))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            answer = self._answer(messages)
+            message = AIMessage(content=answer, usage_metadata=self._usage(messages, answer))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            answer = self._answer(messages)
+            tokens = answer.split(" ")
+            for index, token in enumerate(tokens):
+                text = token if index == len(tokens) - 1 else token + " "
+                yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, answer)))
+
+    return (BenchEmbeddings(args.embed_dim, args.embed_latency),
+            BenchChatModel(latency=args.llm_latency, token_delay=args.token_delay))
+
+
+def setup_environment(args, workdir: str):
+    # Modüller import edilmeden önce: durum dosyaları geçici dizine, API anahtarı sahte
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    os.environ["STATE_DIR"] = os.path.join(workdir, "state")
+    os.environ.setdefault("VERSION_POLL_INTERVAL", "0.5")
+    warnings.filterwarnings("ignore")
+
+
+def patch_app(args, upload_dir: str):
+    from qdrant_client import QdrantClient
+    import ingest_text_files
+    import feed
+
+    embeddings, llm = build_fakes(args)
+    client = QdrantClient(location=":memory:")
+    ingest_text_files.store_manager._client = client
+    ingest_text_files.store_manager._new_client = lambda: client
+    if not args.real_embeddings:
+        ingest_text_files.embeddings.underlying = embeddings
+        ingest_text_files.store_manager.embedding_model = f"bench-fake-{args.embed_dim}"
+        ingest_text_files.store_manager.embedding_dim = args.embed_dim
+    feed.llm = llm
+    feed.UPLOAD_DIR = upload_dir
+
+    ocr_mode = "tesseract"
+    if not shutil.which("tesseract"):
+        # Tesseract yoksa OCR sabit metin döner; süre ölçümü OCR hariç geri kalan yolu kapsar
+        import ocr
+        ocr.pytesseract.image_to_string = lambda img, lang=None: "Soru: f(x) = x^2 fonksiyonunun türevini bulun."
+        pool = ThreadPoolExecutor(max_workers=ocr.OCR_WORKERS, thread_name_prefix="bench-ocr")
+        ingest_text_files.get_ocr_executor = lambda: pool
+        ocr_mode = "fake"
+    return feed, ocr_mode
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    def __init__(self, app, port: int):
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True, name="bench-server")
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+def wait_job(session, base_url: str, job_id: str, timeout: float = 900) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = session.get(f"{base_url}/jobs/{job_id}", timeout=30).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def bench_pdf_ingest(session, base_url: str, paths: list) -> dict:
+    upload_latencies = []
+    jobs = []
+    started = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            t0 = time.perf_counter()
+            response = session.post(f"{base_url}/upload-pdf", files={"file": (os.path.basename(path), f, "application/pdf")},
+                                    timeout=300)
+            upload_latencies.append(time.perf_counter() - t0)
+        response.raise_for_status()
+        jobs.append(response.json()["job_id"])
+    results = [wait_job(session, base_url, job_id) for job_id in jobs]
+    elapsed = time.perf_counter() - started
+    done = [job for job in results if job["status"] == "done"]
+    pages = sum(job["result"].get("pages", 0) for job in done)
+    chunks = sum(job["result"].get("chunks", 0) for job in done)
+    job_seconds = [job["finished_at"] - job["created_at"] for job in done]
+    return {
+        "files": len(paths),
+        "failed": len(results) - len(done),
+        "pages": pages,
+        "chunks": chunks,
+        "wall_s": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 2),
+        "chunks_per_s": round(chunks / elapsed, 2),
+        "upload": summarize(upload_latencies),
+        "job": summarize(job_seconds),
+    }
+
+
+def bench_images(session, base_url: str, paths: list) -> dict:
+    upload_latencies = []
+    job_seconds = []
+    failed = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            t0 = time.perf_counter()
+            response = session.post(f"{base_url}/upload-image", files={"file": (os.path.basename(path), f, "image/jpeg")},
+                                    timeout=300)
+            upload_latencies.append(time.perf_counter() - t0)
+        if response.status_code == 202:
+            job = wait_job(session, base_url, response.json()["job_id"])
+            job_seconds.append(time.perf_counter() - t0)
+            failed += job["status"] != "done"
+    # Aynı görsel tekrar: perceptual hash cache'inden dönmeli
+    cached_latencies = []
+    for path in paths:
+        with open(path, "rb") as f:
+            t0 = time.perf_counter()
+            response = session.post(f"{base_url}/upload-image", files={"file": (os.path.basename(path), f, "image/jpeg")},
+                                    timeout=300)
+            cached_latencies.append(time.perf_counter() - t0)
+    return {"files": len(paths), "failed": failed, "upload": summarize(upload_latencies),
+            "end_to_end": summarize(job_seconds), "cached_upload": summarize(cached_latencies)}
+
+
+def parse_sse(response):
+    # İlk token ve toplam süre için olayları sırayla döndürür
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: ") and event:
+            yield event, line[6:]
+            event = None
+
+
+def bench_messages(base_url: str, items: list, concurrency: int, stream: bool) -> dict:
+    import requests
+    local = threading.local()
+
+    def send(index_question):
+        index, question = index_question
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        payload = {"name": question, "session_id": f"bench-{concurrency}-{index}"}
+        t0 = time.perf_counter()
+        first_token = None
+        if stream:
+            with local.session.post(f"{base_url}/message/stream", json=payload, stream=True, timeout=300) as response:
+                if response.status_code != 200:
+                    return response.status_code, time.perf_counter() - t0, None, False
+                for event, _ in parse_sse(response):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - t0
+                    elif event == "error":
+                        return 500, time.perf_counter() - t0, first_token, False
+            return 200, time.perf_counter() - t0, first_token, False
+        response = local.session.post(f"{base_url}/message", json=payload, timeout=300)
+        elapsed = time.perf_counter() - t0
+        cached = response.status_code == 200 and response.json().get("cached", False)
+        return response.status_code, elapsed, None, cached
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, enumerate(items)))
+    elapsed = time.perf_counter() - started
+    ok = [r for r in results if r[0] == 200]
+    summary = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "status_codes": {str(code): sum(1 for r in results if r[0] == code) for code in sorted({r[0] for r in results})},
+        "cached": sum(1 for r in ok if r[3]),
+        "wall_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "latency": summarize([r[1] for r in ok]),
+    }
+    if stream:
+        summary["first_token"] = summarize([r[2] for r in ok if r[2] is not None])
+    return summary
+
+
+def compare(current: dict, previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    rows = []
+    def add(label, new, old):
+        if old:
+            rows.append(f"{label:<40} {old:>10.2f} -> {new:>10.2f}  ({(new - old) / old * 100:+.1f}%)")
+    add("ingest pages/s", current["ingest"]["pages_per_s"], previous.get("ingest", {}).get("pages_per_s"))
+    for key, run in current["message"].items():
+        old = previous.get("message", {}).get(key, {})
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            add(f"message {key} {metric}", run["latency"][metric], old.get("latency", {}).get(metric))
+        add(f"message {key} rps", run["throughput_rps"], old.get("throughput_rps"))
+    add("peak rss self MB", current["rss_mb"]["self"], previous.get("rss_mb", {}).get("self"))
+    print(f"\n📊 Karşılaştırma ({previous_path}):")
+    print("\n".join(rows) or "Ortak metrik yok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sahte LLM/embedding ve in-memory Qdrant ile benchmark")
+    parser.add_argument("--pdfs", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="Her eşzamanlılık seviyesi için /message isteği")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--stream", action="store_true", help="/message yerine /message/stream")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Tekrarlanan (cache'lenebilir) soru oranı")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Sahte LLM ilk cevap gecikmesi (s)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Stream'de token başına gecikme (s)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Sahte embedding çağrı gecikmesi (s)")
+    parser.add_argument("--embed-dim", type=int, default=768)
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="Sahte yerine EMBEDDING_PROVIDER'daki modeli kullan (ör. EMBEDDING_PROVIDER=local)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="Varsayılan: geçici dizin (sonunda silinir)")
+    parser.add_argument("--output", help=f"Varsayılan: {DEFAULT_OUTPUT_DIR}/bench-<zaman>.json")
+    parser.add_argument("--compare", help="Önceki bir sonuç dosyasıyla karşılaştır")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    upload_dir = os.path.join(workdir, "uploads")
+    corpus_dir = os.path.join(workdir, "corpus")
+    os.makedirs(upload_dir, exist_ok=True)
+    os.makedirs(corpus_dir, exist_ok=True)
+    setup_environment(args, workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        print(f"🧪 Korpus üretiliyor ({workdir})")
+        pdfs = generate_pdfs(corpus_dir, args.pdfs, args.pages, args.seed)
+        images = generate_images(corpus_dir, args.images, args.seed)
+        feed, ocr_mode = patch_app(args, upload_dir)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+
+        import requests
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "commit": git_commit(),
+                "python": sys.version.split()[0],
+                "cpu_count": os.cpu_count(),
+                "ocr": ocr_mode,
+                "embeddings": feed.EMBEDDING_MODEL if args.real_embeddings else f"bench-fake-{args.embed_dim}",
+                "args": vars(args),
+            },
+        }
+        with ServerThread(feed.app, port), requests.Session() as session:
+            print(f"📄 PDF ingest: {len(pdfs)} dosya x {args.pages} sayfa")
+            results["ingest"] = bench_pdf_ingest(session, base_url, pdfs)
+            results["rss_mb_after_ingest"] = peak_rss_mb()
+            print(f"📸 Görsel yükleme: {len(images)} dosya")
+            results["images"] = bench_images(session, base_url, images)
+            deadline = time.time() + 30
+            while not session.get(f"{base_url}/health", timeout=10).json()["ready"] and time.time() < deadline:
+                time.sleep(0.1)
+            results["message"] = {}
+            for level in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+                print(f"💬 /message: {args.requests} istek, eşzamanlılık {level}")
+                items = questions(args.requests, args.repeat_ratio, args.seed + level, label=f"c{level}-")
+                results["message"][f"c{level}"] = bench_messages(base_url, items, level, args.stream)
+            results["health"] = session.get(f"{base_url}/health", timeout=10).json()
+        results["rss_mb"] = peak_rss_mb()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+
+    ingest = results["ingest"]
+    print(f"\n📄 Ingest: {ingest['pages']} sayfa, {ingest['pages_per_s']} sayfa/s, {ingest['chunks_per_s']} chunk/s, "
+          f"upload p95 {ingest['upload']['p95_ms']} ms")
+    print(f"📸 Görsel: uçtan uca p50 {results['images']['end_to_end']['p50_ms']} ms, "
+          f"cache'li upload p50 {results['images']['cached_upload']['p50_ms']} ms")
+    for key, run in results["message"].items():
+        latency = run["latency"]
+        print(f"💬 {key}: p50 {latency['p50_ms']} / p95 {latency['p95_ms']} / p99 {latency['p99_ms']} ms, "
+              f"{run['throughput_rps']} istek/s, {run['errors']} hata")
+    print(f"🧠 Tepe RSS: {results['rss_mb']['self']} MB (alt süreçler {results['rss_mb']['children']} MB)")
+    print(f"💾 Sonuçlar: {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
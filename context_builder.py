@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import Counter
+from langchain_core.documents import Document
+from ingest_pipeline import CHUNK_OVERLAP, BOILERPLATE_SECTIONS, classify_page
+from reformulation import normalize_question
+from session_store import estimate_tokens
+
+# {context} için yaklaşık token üst sınırı
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Bu uzunluktan kısa örtüşmeler tesadüf sayılır
+OVERLAP_MIN_CHARS = int(os.getenv("OVERLAP_MIN_CHARS", "30"))
+OVERLAP_MAX_CHARS = 2 * CHUNK_OVERLAP
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(stats)
+
+
+def _overlap_length(tail_text: str, head_text: str) -> int:
+    # tail_text'in sonu ile head_text'in başı arasındaki en uzun ortak parça
+    longest = min(len(tail_text), len(head_text), OVERLAP_MAX_CHARS)
+    for size in range(longest, OVERLAP_MIN_CHARS - 1, -1):
+        if tail_text.endswith(head_text[:size]):
+            return size
+    return 0
+
+
+def trim_overlap(kept_text: str, text: str) -> str:
+    # Text splitter'ın komşu chunk'lara kopyaladığı CHUNK_OVERLAP kadar metni bir kez tut
+    size = _overlap_length(kept_text, text)
+    if size:
+        text = text[size:].lstrip()
+    size = _overlap_length(text, kept_text)
+    if size:
+        text = text[:-size].rstrip()
+    return text
+
+
+def section_of(doc: Document) -> str:
+    # Eski chunk'larda section yoksa aynı sınıflandırıcı chunk metnine uygulanır
+    section = doc.metadata.get("section")
+    if section:
+        return section
+    return classify_page(doc.page_content, doc.metadata.get("page"), doc.metadata.get("total_pages"))
+
+
+def pack_context(docs: list, token_budget: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+    # docs retriever sırasıyla (en alakalı önce) gelir; boilerplate ve tekrarlar atılır,
+    # örtüşmeler kırpılır, bütçeye sığanlar alınır. Dönüş: (docs, istatistik)
+    packed, used = [], 0
+    seen = set()
+    result = Counter(retrieved=len(docs))
+    for doc in docs:
+        if section_of(doc) in BOILERPLATE_SECTIONS:
+            result["dropped_boilerplate"] += 1
+            continue
+        key = normalize_question(doc.page_content)
+        if key in seen:
+            result["dropped_duplicate"] += 1
+            continue
+        seen.add(key)
+        text = doc.page_content
+        source = doc.metadata.get("source")
+        for kept in packed:
+            if kept.metadata.get("source") == source:
+                text = trim_overlap(kept.page_content, text)
+        result["overlap_trimmed_tokens"] += estimate_tokens(doc.page_content) - estimate_tokens(text)
+        if not text:
+            result["dropped_duplicate"] += 1
+            continue
+        cost = estimate_tokens(text)
+        if used + cost > token_budget:
+            if packed:
+                result["dropped_budget"] += 1
+                continue
+            # En alakalı chunk tek başına bütçeyi aşıyorsa kırpılarak alınır
+            text = text[:token_budget * 4]
+            cost = estimate_tokens(text)
+        packed.append(Document(page_content=text, metadata=dict(doc.metadata)))
+        used += cost
+    result["context_chunks"] = len(packed)
+    result["context_tokens"] = used
+    with _stats_lock:
+        stats.update(result)
+        stats["requests"] += 1
+    return packed, dict(result)
+
+
+def pack_documents(docs: list) -> list:
+    # Zincirde retriever'dan sonra çalışır
+    packed, result = pack_context(docs)
+    print(f"🧩 Bağlam: {result['context_chunks']}/{result['retrieved']} chunk, ~{result['context_tokens']} token")
+    return packed
+
+
+def usage_summary(usage_metadata: dict, docs: list) -> dict:
+    # UsageMetadataCallbackHandler çıktısı: model başına toplam; yeniden yazma çağrısı da dahildir
+    prompt_tokens = sum(u.get("input_tokens", 0) for u in usage_metadata.values()) if usage_metadata else None
+    output_tokens = sum(u.get("output_tokens", 0) for u in usage_metadata.values()) if usage_metadata else None
+    return {
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "context_tokens": sum(estimate_tokens(d.page_content) for d in docs),
+        "context_chunks": len(docs),
+    }
@@ -0,0 +1,141 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from ingest_registry import STATE_DIR, hash_text
+from metrics import stage, cache_event
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(STATE_DIR, "embedding_cache.db"))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024"))
+
+# SQLite IN (...) parametre sınırının altında kal
+_LOOKUP_BATCH = 500
+
+
+def _encode(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> list:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    # Herhangi bir Embeddings nesnesini sarar: doküman embedding'leri SQLite'ta,
+    # soru embedding'leri bellekte LRU olarak tutulur
+    def __init__(self, underlying: Embeddings, model_name: str, task_type: str,
+                 path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+                 query_cache_size: int = QUERY_EMBED_CACHE_SIZE):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.task_type = task_type
+        self.path = path
+        self.max_entries = max_entries
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}|{self.task_type}|{hash_text(text)}".encode()).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        now = time.time()
+        with self._connect() as conn:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                part = keys[i:i + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update({key: _decode(blob) for key, blob in rows})
+            if found:
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+        return found
+
+    def _store(self, items: list):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, _encode(vector), now) for key, vector in items],
+            )
+            count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                # En uzun süredir kullanılmayanları sil, %10 pay bırak ki her yazmada silme olmasın
+                excess = count - int(self.max_entries * 0.9)
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (excess,)
+                )
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += len(missing)
+        cache_event("embedding_document", True, len(texts) - sum(1 for key in keys if key in missing))
+        cache_event("embedding_document", False, len(missing))
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        key = self._key(text)
+        with self._lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                self.query_hits += 1
+                cache_event("embedding_query", True)
+                return self._query_cache[key]
+        cache_event("embedding_query", False)
+        with stage("embed_query"):
+            vector = self.underlying.embed_query(text)
+        with self._lock:
+            self.query_misses += 1
+            self._query_cache[key] = vector
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def stats(self) -> dict:
+        return {
+            "document_hits": self.hits,
+            "document_misses": self.misses,
+            "query_hits": self.query_hits,
+            "query_misses": self.query_misses,
+        }
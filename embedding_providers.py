@@ -0,0 +1,111 @@
+import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from ingest_registry import hash_file
+
+# google | local
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "google").lower()
+GOOGLE_EMBEDDING_MODEL = os.getenv("GOOGLE_EMBEDDING_MODEL", "text-embedding-004")
+GOOGLE_EMBEDDING_DIMENSIONS = {"text-embedding-004": 768, "gemini-embedding-001": 3072}
+EMBEDDING_TASK_TYPE = "RETRIEVAL_DOCUMENT"
+
+# Yerel model dizini: model.onnx (ya da onnx/model.onnx) ve tokenizer.json (HF export)
+LOCAL_EMBEDDING_MODEL_PATH = os.getenv("LOCAL_EMBEDDING_MODEL_PATH", "/models/embedding")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+LOCAL_EMBEDDING_MAX_LENGTH = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "512"))
+# 0 = onnxruntime varsayılanı (çekirdek sayısı)
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+# mean | cls; model zaten (batch, dim) döndürüyorsa kullanılmaz
+LOCAL_EMBEDDING_POOLING = os.getenv("LOCAL_EMBEDDING_POOLING", "mean").lower()
+# e5 gibi modeller "query: " / "passage: " önekleri bekler
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "")
+LOCAL_EMBEDDING_DOCUMENT_PREFIX = os.getenv("LOCAL_EMBEDDING_DOCUMENT_PREFIX", "")
+
+
+def _find_model_file(path: str) -> str:
+    for candidate in ("model.onnx", os.path.join("onnx", "model.onnx")):
+        model_file = os.path.join(path, candidate)
+        if os.path.exists(model_file):
+            return model_file
+    raise FileNotFoundError(f"{path} altında model.onnx bulunamadı")
+
+
+class OnnxEmbeddings(Embeddings):
+    # CPU üzerinde ONNX Runtime ile embedding: tokenizer batch'i tek seferde kodlar,
+    # pooling ve normalizasyon NumPy ile vektörel yapılır. Ağ çağrısı yok.
+    def __init__(self, path: str = LOCAL_EMBEDDING_MODEL_PATH, batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+                 max_length: int = LOCAL_EMBEDDING_MAX_LENGTH, threads: int = LOCAL_EMBEDDING_THREADS,
+                 pooling: str = LOCAL_EMBEDDING_POOLING):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_PROVIDER=local için onnxruntime ve tokenizers kurulu olmalı") from e
+        self.path = path
+        self.model_file = _find_model_file(path)
+        self.batch_size = batch_size
+        self.pooling = pooling
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(self.model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimension = len(self._embed(["dimension"])[0])
+        # Cache anahtarları ve koleksiyon metadata'sı için: aynı ad, farklı ağırlık karışmasın
+        self.model_name = f"local:{os.path.basename(os.path.normpath(path))}:{hash_file(self.model_file)[:12]}"
+
+    def _run(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        output = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        if output.ndim == 3:
+            if self.pooling == "cls":
+                output = output[:, 0]
+            else:
+                mask = attention_mask[..., None].astype(output.dtype)
+                output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return output / np.clip(np.linalg.norm(output, axis=1, keepdims=True), 1e-12, None)
+
+    def _embed(self, texts: list) -> list:
+        # Benzer uzunluktaki metinler aynı batch'e düşsün diye sıralanır; padding azalır
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for index, vector in zip(batch, self._run([texts[i] for i in batch])):
+                vectors[index] = vector.tolist()
+        return vectors
+
+    def embed_documents(self, texts: list) -> list:
+        return self._embed([LOCAL_EMBEDDING_DOCUMENT_PREFIX + text for text in texts])
+
+    def embed_query(self, text: str) -> list:
+        return self._embed([LOCAL_EMBEDDING_QUERY_PREFIX + text])[0]
+
+
+def build_embeddings(provider: str = EMBEDDING_PROVIDER):
+    # Dönüş: (embeddings, model adı, boyut); boyut bilinmiyorsa None
+    if provider == "local":
+        local = OnnxEmbeddings()
+        print(f"🧠 Yerel embedding modeli yüklendi: {local.model_name} (dim={local.dimension})")
+        return local, local.model_name, local.dimension
+    if provider != "google":
+        raise ValueError(f"Bilinmeyen EMBEDDING_PROVIDER: {provider}")
+    from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("❌ GOOGLE_API_KEY .env'de bulunamadı!")
+    google = GoogleGenerativeAIEmbeddings(
+        model=GOOGLE_EMBEDDING_MODEL,
+        task_type=EMBEDDING_TASK_TYPE,
+        google_api_key=api_key
+    )
+    return google, GOOGLE_EMBEDDING_MODEL, GOOGLE_EMBEDDING_DIMENSIONS.get(GOOGLE_EMBEDDING_MODEL.split("/")[-1])
@@ -0,0 +1,11 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Event loop'u bloklayan işler için açıkça boyutlandırılmış havuzlar
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "32"))
+
+# Upload dosya yazma vb. disk işleri
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+# Event loop'un varsayılan executor'u: LangChain'in sync retriever çağrıları, asyncio.to_thread
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
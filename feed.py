@@ -1,42 +1,200 @@
-from ingest_text_files import get_retriever, ingest_from_docs, ingest_from_image
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
+from ingest_text_files import get_retriever, ingest_from_docs, ingest_from_image, ingest_pdf, pending_pdfs, collection_ready, embeddings, store_manager, registry, lexical_index, sync_lexical_index, retrieval_filter, delete_source, optimize_collection, EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIM
+from ingest_jobs import JobManager, JobQueueFull
+from ingest_registry import file_lock
+from ingest_writer import is_rate_limited
+from vector_store import EmbeddingMismatch
+from executors import io_executor, blocking_executor
+from reformulation import build_retrieval_runnable, is_standalone, normalize_question, get_stats as reformulation_stats
+from answer_cache import AnswerCache
+from llm_governor import LLMGovernor, LLMSaturated
+from session_store import SessionStore, SQLiteChatMessageHistory
+from uploads import (MAX_PDF_BYTES, MAX_IMAGE_BYTES, MULTIPART_OVERHEAD, UploadTooLarge, copy_upload,
+                     finalize_upload, normalize_image, display_name, cleanup_incoming)
+from image_cache import ImageResultCache, dhash, text_matches
+from ocr import get_ocr_executor, ocr_image_file
+from context_builder import pack_documents, usage_summary, get_stats as context_stats
+from graphs import parse_graph, render_graph, graph_path, get_stats as graph_stats
+from metrics import (StageTimer, record_stage, REQUEST_ID_HEADER, REQUEST_LATENCY, request_id_var, trace_var, new_request_id,
+                     log, stage, cache_event, record_usage, format_trace, register_stats, render_metrics)
+from fastapi import FastAPI, File, UploadFile, HTTPException, Response
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from pydantic import BaseModel
+from typing import Optional
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_core.messages import HumanMessage, AIMessage
 from uuid import uuid4
-import os, io, base64, json
+from contextlib import asynccontextmanager
+import os, re, time, base64, json, threading, asyncio
 from PIL import Image
-import matplotlib.pyplot as plt
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="VBO DE Bootcamp RAG Assistant")
-
 UPLOAD_DIR = "/tmp/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-print("📚 Başlangıç kontrol ediliyor...")
+# Diğer worker'ların ingest'leri registry sürümünden izlenir
+VERSION_POLL_INTERVAL = float(os.getenv("VERSION_POLL_INTERVAL", "2"))
+
 retriever = None
+loaded_version = None
+startup_state = {"reconciling": False, "pending_files": 0, "error": None}
 
-try:
-    pdf_files = [f for f in os.listdir(UPLOAD_DIR) if f.endswith('.pdf')]
-    if pdf_files:
-        print(f"📄 {len(pdf_files)} PDF dosyası bulundu, yükleniyor...")
-        success = ingest_from_docs(UPLOAD_DIR)
-        if success:
-            retriever = get_retriever()
-            print("✅ Retriever hazır")
-    else:
-        print("⚠️  Başlangıçta PDF bulunamadı.")
-except Exception as e:
-    print(f"⚠️  Başlangıç yüklemesi atlandı: {e}")
+def refresh_chains():
+    # Retriever canlı QdrantVectorStore'u okur; sürüm değişince zincirleri yeniden kurmak gerekmez,
+    # sadece sürüm kaydedilir (cevap cache'i sürümle anahtarlı). Zincirler yalnızca henüz yoksa kurulur.
+    # Kurulamazsa (Qdrant erişilemez, koleksiyon boş) sürüm kaydedilmez ki watcher tekrar denesin.
+    global loaded_version
+    version = registry.get_version()
+    if qa_chain is not None:
+        loaded_version = version
+        return False
+    if not collection_ready():
+        return False
+    try:
+        # Koleksiyon başka bir embedding modeliyle doldurulmuşsa zincir kurulmaz; sürüm değişene kadar tekrar denenmez
+        store_manager.verify_embeddings()
+    except EmbeddingMismatch as e:
+        loaded_version = version
+        startup_state["error"] = str(e)
+        print(f"❌ Embedding modeli uyuşmuyor, zincirler kurulmadı: {e}")
+        return False
+    if initialize_chains(get_retriever()):
+        loaded_version = version
+        print(f"🔁 Index sürümü {version} yüklendi")
+        return True
+    return False
+
+async def watch_index_version():
+    while True:
+        await asyncio.sleep(VERSION_POLL_INTERVAL)
+        try:
+            # Zincir yokken loaded_version kaydedilmediği için bu koşul kurulana kadar her turda sağlanır
+            if await asyncio.to_thread(registry.get_version) != loaded_version:
+                await asyncio.to_thread(refresh_chains)
+        except Exception as e:
+            print(f"⚠️  Index sürümü kontrol edilemedi: {e}")
+
+def reconcile_index(pending: list):
+    # Manifest ile diskteki PDF'ler uyuşmuyorsa arka planda artımlı ingest.
+    # Birden fazla worker varsa sadece kilidi alan senkronize eder.
+    with file_lock("reconcile", blocking=False) as acquired:
+        if not acquired:
+            print("ℹ️  Senkronizasyon başka bir worker'da sürüyor")
+            return
+        startup_state["reconciling"] = True
+        startup_state["pending_files"] = len(pending)
+        try:
+            print(f"🔄 {len(pending)} PDF arka planda senkronize ediliyor...")
+            success = ingest_from_docs(UPLOAD_DIR)
+            if success:
+                refresh_chains()
+            print("✅ Arka plan senkronizasyonu tamamlandı")
+        except Exception as e:
+            startup_state["error"] = str(e)
+            print(f"⚠️  Arka plan senkronizasyonu başarısız: {e}")
+        finally:
+            startup_state["reconciling"] = False
+            startup_state["pending_files"] = 0
+
+main_loop = None
+
+def startup_check():
+    try:
+        cleanup_incoming(UPLOAD_DIR)
+        if collection_ready():
+            # Model/boyut uyuşmazlığında zincir kurulmaz, hata /health'te görünür
+            store_manager.verify_embeddings()
+            store_manager.ensure_schema()
+        if refresh_chains():
+            print("✅ Mevcut koleksiyon bağlandı, retriever hazır")
+        threading.Thread(target=sync_lexical_index, daemon=True).start()
+        pending = pending_pdfs(UPLOAD_DIR)
+        if pending:
+            threading.Thread(target=reconcile_index, args=(pending,), daemon=True).start()
+        elif not retriever:
+            print("⚠️  Başlangıçta PDF bulunamadı.")
+    except Exception as e:
+        startup_state["error"] = str(e)
+        print(f"⚠️  Başlangıç kontrolü atlandı: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global main_loop
+    print("📚 Başlangıç kontrol ediliyor...")
+    main_loop = asyncio.get_running_loop()
+    # LangChain'in sync retriever çağrıları ve asyncio.to_thread bu havuzu kullanır
+    main_loop.set_default_executor(blocking_executor)
+    store_manager.start_health_checks()
+    await asyncio.to_thread(startup_check)
+    watcher = asyncio.create_task(watch_index_version())
+    yield
+    watcher.cancel()
+
+app = FastAPI(title="VBO DE Bootcamp RAG Assistant", lifespan=lifespan)
+
+UPLOAD_LIMITS = {"/upload-pdf": MAX_PDF_BYTES, "/upload-image": MAX_IMAGE_BYTES}
+
+@app.middleware("http")
+async def reject_oversized_uploads(request, call_next):
+    # Content-Length sınırı aşıyorsa gövde okunmadan 413 döner
+    limit = UPLOAD_LIMITS.get(request.url.path)
+    if limit is None and request.method == "PUT" and request.url.path.startswith("/documents/"):
+        limit = max(MAX_PDF_BYTES, MAX_IMAGE_BYTES)
+    length = request.headers.get("content-length")
+    if limit is not None and length and length.isdigit() and int(length) > limit + MULTIPART_OVERHEAD:
+        return JSONResponse(status_code=413, content={"detail": str(UploadTooLarge(limit))})
+    return await call_next(request)
+
+# Loglanmayan (ama ölçülen) yoklama endpoint'leri
+QUIET_ROUTES = {"/health", "/metrics", "/jobs/{job_id}"}
+
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    # İstek kimliği Streamlit'ten X-Request-ID ile gelir (yoksa üretilir), loglara ve yanıta eklenir.
+    # Süre yanıt gövdesi bittiğinde ölçülür; SSE akışları da tam süreleriyle kaydedilir.
+    request_id = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+    request_id_var.set(request_id)
+    trace = []
+    trace_var.set(trace)
+    started = time.perf_counter()
+    response = await call_next(request)
+    response.headers[REQUEST_ID_HEADER] = request_id
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+
+    def finish():
+        elapsed = time.perf_counter() - started
+        REQUEST_LATENCY.labels(request.method, route_path, str(response.status_code)).observe(elapsed)
+        if route_path not in QUIET_ROUTES:
+            stages = f" ({format_trace(trace)})" if trace else ""
+            print(f"[{request_id}] ⏱️  {request.method} {request.url.path} {response.status_code} "
+                  f"{elapsed * 1000:.0f}ms{stages}")
+
+    body = response.body_iterator
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish()
+    response.body_iterator = timed_body()
+    return response
+
+@app.exception_handler(LLMSaturated)
+async def llm_saturated_handler(request, exc: LLMSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Sistem şu an yoğun, lütfen tekrar deneyin: {exc}"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 api_key = os.getenv("GOOGLE_API_KEY")
 if not api_key:
@@ -45,14 +203,36 @@ if not api_key:
 llm = ChatGoogleGenerativeAI(
     model="gemini-2.5-flash", 
     temperature=0.7,
-    google_api_key=api_key
+    google_api_key=api_key,
+    # 429 tekrar denemeleri LLMGovernor'da, slot dışında ve jitter ile yapılır
+    max_retries=1
 )
 
-store = {}
+governor = LLMGovernor()
+
+def call_llm_from_thread(coro_factory):
+    # Job thread'lerinden gelen çağrılar da ana event loop'taki governor'dan geçer;
+    # arka plan işleri kuyrukta süresiz bekleyebilir
+    future = asyncio.run_coroutine_threadsafe(governor.run(coro_factory, timeout=None), main_loop)
+    return future.result()[0]
+
+async def run_blocking(executor, fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+answer_cache = AnswerCache(embed_query=embeddings.embed_query)
+image_cache = ImageResultCache()
+register_stats({
+    "embedding_cache": embeddings.stats, "answer_cache": answer_cache.stats, "image_cache": image_cache.stats,
+    "reformulation": reformulation_stats, "context_builder": context_stats, "graphs": graph_stats,
+})
+
+# Oturumlar SQLite'ta tutulur: restart ve birden fazla worker arasında korunur
+session_store = SessionStore()
+DEFAULT_SESSION_ID = "default_session"
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return SQLiteChatMessageHistory(session_store, session_id)
 
 contextualize_q_prompt = ChatPromptTemplate.from_messages([
     ("system", "Given chat history and latest question, reformulate if needed"),
@@ -75,14 +255,19 @@ qa_prompt_template = ChatPromptTemplate.from_messages([
     1. Cevabı açıkla
     2. Sonra ŞU FORMATTA grafiksel gösterim ver:
     
+    Fonksiyonlar için (noktaları tek tek yazma, sistem örnekler):
+    GRAPH: f(x) = <ifade>, [başlangıç, bitiş]
+    Ölçüm/tablo verisi için:
     GRAPH: [x_değerleri], [y_değerleri]
     
     ÖRNEKLER:
-    - Parabol: GRAPH: [-2,-1,0,1,2], [4,1,0,1,4]
-    - Doğru: GRAPH: [0,1,2,3], [0,2,4,6]
-    - Trigonometrik: GRAPH: [0,1.57,3.14,4.71,6.28], [0,1,0,-1,0]
+    - Parabol: GRAPH: f(x) = x**2 - 4, [-3, 3]
+    - Doğru: GRAPH: f(x) = 2*x + 1, [0, 5]
+    - Trigonometrik: GRAPH: f(x) = sin(x), [0, 2*pi]
     - Sütun grafik: GRAPH: [0,1,2,3], [10,20,15,25]
     - Herhangi veri: GRAPH: [x1,x2,x3,...], [y1,y2,y3,...]
+    İfadede x, pi, e, + - * / **, sin cos tan exp log sqrt abs kullanılabilir.
+    Birden fazla GRAPH satırı aynı grafikte çizilir.
     
     Bağlam:
     {context}
@@ -96,41 +281,62 @@ question_answer_chain = None
 rag_chain = None
 qa_chain = None
 
-def initialize_chains():
-    global history_aware_retriever, question_answer_chain, rag_chain, qa_chain
-    if not retriever:
+chain_lock = threading.Lock()
+
+def initialize_chains(new_retriever=None):
+    # Yeni zincirler önce yerelde kurulur, sonra tek seferde yer değiştirir;
+    # devam eden istekler eski zinciri kullanmaya devam eder
+    global retriever, history_aware_retriever, question_answer_chain, rag_chain, qa_chain
+    new_retriever = new_retriever or retriever
+    if not new_retriever:
         print("⚠️  Retriever yok")
         return False
     try:
-        history_aware_retriever = create_history_aware_retriever(
-            llm, retriever, contextualize_q_prompt
-        )
-        question_answer_chain = create_stuff_documents_chain(llm, qa_prompt_template)
-        rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-        qa_chain = RunnableWithMessageHistory(
-            rag_chain,
+        # Getirilen chunk'lar {context}'e girmeden önce token bütçesine göre paketlenir
+        new_history_aware_retriever = build_retrieval_runnable(
+            llm, new_retriever, contextualize_q_prompt
+        ) | RunnableLambda(pack_documents)
+        new_question_answer_chain = create_stuff_documents_chain(llm, qa_prompt_template)
+        new_rag_chain = create_retrieval_chain(new_history_aware_retriever, new_question_answer_chain)
+        new_qa_chain = RunnableWithMessageHistory(
+            new_rag_chain,
             get_session_history,
             input_messages_key="input",
             history_messages_key="chat_history",
             output_messages_key="answer",
         )
+        with chain_lock:
+            retriever = new_retriever
+            history_aware_retriever = new_history_aware_retriever
+            question_answer_chain = new_question_answer_chain
+            rag_chain = new_rag_chain
+            qa_chain = new_qa_chain
         print("✅ Chain'ler başlatıldı")
         return True
     except Exception as e:
         print(f"❌ Chain başlatma hatası: {e}")
         return False
 
-if retriever:
-    initialize_chains()
+jobs = JobManager()
 
 class Message(BaseModel):
     name: str
+    session_id: Optional[str] = None
+    # Aramayı belirli dokümanlarla (dosya adı) veya türle ("pdf", "image") sınırla
+    documents: Optional[list[str]] = None
+    doc_type: Optional[str] = None
+
+def resolve_session_id(message: Message) -> str:
+    session_id = message.session_id or DEFAULT_SESSION_ID
+    if not SESSION_ID_RE.match(session_id):
+        raise HTTPException(status_code=400, detail="Geçersiz session_id")
+    return session_id
 
 @app.get("/")
 def root():
     return {
         "message": "VBO LLM Bootcamp RAG Assistant",
-        "status": "ready" if retriever else "waiting_for_documents",
+        "status": "ready" if retriever else ("indexing" if startup_state["reconciling"] else "waiting_for_documents"),
         "version": "3.0"
     }
 
@@ -138,197 +344,495 @@ def root():
 def health_check():
     return {
         "status": "healthy",
+        "ready": qa_chain is not None,
         "retriever_ready": retriever is not None,
-        "active_sessions": len(store)
+        "reconciling": startup_state["reconciling"],
+        "pending_files": startup_state["pending_files"],
+        "startup_error": startup_state["error"],
+        "qdrant_healthy": store_manager.healthy,
+        "embedding": {"provider": EMBEDDING_PROVIDER, "model": EMBEDDING_MODEL, "dim": EMBEDDING_DIM},
+        "embedding_cache": embeddings.stats(),
+        "lexical_index_chunks": lexical_index.count(),
+        "reformulation": reformulation_stats(),
+        "context_builder": context_stats(),
+        "answer_cache": answer_cache.stats(),
+        "image_cache": image_cache.stats(),
+        "graphs": graph_stats(),
+        "llm_governor": governor.snapshot(),
+        "worker_pid": os.getpid(),
+        "index_version": loaded_version,
+        "active_sessions": session_store.count()
     }
 
-# Streaming mesaj endpoint
-@app.post("/message")
-def send_request(message: Message):
-    print(f"💬 Soru alındı: {message.name}")
-    
+def resolve_sources(message: Message):
+    # Filtre yoksa None; varsa registry'deki eşleşen kaynak yolları (boşsa 404)
+    if not message.documents and not message.doc_type:
+        return None
+    names = set(message.documents or [])
+    sources = [
+        f["source"] for f in registry.list_files()
+        if (not names or f["source"] in names or os.path.basename(f["source"]) in names
+            or display_name(f["source"]) in names)
+        and (not message.doc_type or f["doc_type"] == message.doc_type)
+    ]
+    if not sources:
+        raise HTTPException(status_code=404, detail="Filtreyle eşleşen doküman bulunamadı")
+    return sorted(sources)
+
+def chain_input(message: Message, allowed_sources) -> dict:
+    inputs = {"input": message.name}
+    if allowed_sources:
+        inputs["search_kwargs"] = retrieval_filter(allowed_sources)
+    return inputs
+
+def require_chain():
     if not retriever:
         raise HTTPException(
             status_code=503,
             detail="Henüz doküman yüklenmedi. PDF yükleyin."
         )
     
-    if not qa_chain:
+    chain = qa_chain
+    if not chain:
         raise HTTPException(
             status_code=503,
             detail="Chain başlatılmadı. PDF yükleyin."
         )
+    return chain
+
+def extract_graph(answer: str):
+    # GRAPH satırları metinden çıkarılır, çizim render havuzunda yapılır ve URL ile sunulur
+    graph_url = None
+    try:
+        answer, spec = parse_graph(answer)
+    except Exception as graph_error:
+        # Ücreti ödenmiş cevap grafik yüzünden kaybolmasın
+        log(f"⚠️ Grafik okunamadı: {graph_error}")
+        return answer, None
+    if spec is not None:
+        try:
+            with stage("graph_render"):
+                graph_url = f"/graphs/{render_graph(spec)}"
+            log("📊 Grafik oluşturuldu")
+        except Exception as graph_error:
+            log(f"⚠️ Grafik oluşturulamadı: {graph_error}")
+    return answer, graph_url
+
+def source_metadata(docs: list):
+    return [
+        {"source": display_name(d.metadata.get("source", "")), "page": d.metadata.get("page"),
+         "type": d.metadata.get("type")}
+        for d in docs
+    ]
+
+async def lookup_cached_answer(question: str, session_id: str, scope: str = ""):
+    # Sadece bağımsız sorular cache'lenir; takip soruları sohbet geçmişine bağlıdır
+    history = get_session_history(session_id)
+    if not is_standalone(question, await asyncio.to_thread(lambda: history.messages)):
+        return None, None
+    version = registry.get_version()
+    with stage("answer_cache"):
+        cached = await asyncio.to_thread(answer_cache.get, question, version, scope)
+    cache_event("answer", cached is not None)
+    if cached is not None:
+        await asyncio.to_thread(history.add_messages,
+                                [HumanMessage(content=question), AIMessage(content=cached["text"])])
+        log("⚡ Cevap cache'ten döndü")
+    return version, cached
+
+async def store_cached_answer(question: str, version, value: dict, scope: str = ""):
+    if version is not None:
+        value = {k: v for k, v in value.items() if k != "usage"}
+        await asyncio.to_thread(answer_cache.put, question, version, value, scope)
+
+CACHED_USAGE = {"prompt_tokens": 0, "output_tokens": 0, "context_tokens": 0, "context_chunks": 0}
+
+def log_usage(usage: dict, retrieved: int = None):
+    record_usage(usage, retrieved)
+    log(f"🧮 Prompt: {usage['prompt_tokens']} token, bağlam: ~{usage['context_tokens']} token "
+          f"({usage['context_chunks']} chunk)")
+
+@app.post("/message")
+async def send_request(message: Message):
+    log(f"💬 Soru alındı: {message.name}")
+    chain = require_chain()
+    session_id = resolve_session_id(message)
+    allowed_sources = await asyncio.to_thread(resolve_sources, message)
+    scope = "|".join(allowed_sources or [])
     
     try:
-        # RAG chain ile yanıt al
-        session_id = "default_session"  # Her kullanıcı için farklı olabilir
-        
-        print(f"🔍 RAG chain çalıştırılıyor...")
-        result = qa_chain.invoke(
-            {"input": message.name},
-            config={"configurable": {"session_id": session_id}}
-        )
-        
-        # ✅ DOĞRU: result bir dict, "answer" anahtarından yanıtı al
-        answer = result.get("answer", "Yanıt bulunamadı.")
+        version, cached = await lookup_cached_answer(message.name, session_id, scope)
+        if cached is not None:
+            return {**cached, "usage": CACHED_USAGE, "cached": True}
         
-        print(f"✅ Yanıt oluşturuldu: {len(answer)} karakter")
+        async def run_chain():
+            log(f"🔍 RAG chain çalıştırılıyor...")
+            usage_handler = UsageMetadataCallbackHandler()
+            timer = StageTimer()
+            with stage("chain"):
+                result = await chain.ainvoke(
+                    chain_input(message, allowed_sources),
+                    config={"configurable": {"session_id": session_id}, "callbacks": [usage_handler, timer]}
+                )
+            
+            # ✅ DOĞRU: result bir dict, "answer" anahtarından yanıtı al
+            answer = result.get("answer", "Yanıt bulunamadı.")
+            
+            log(f"✅ Yanıt oluşturuldu: {len(answer)} karakter")
+            
+            usage = usage_summary(usage_handler.usage_metadata, result.get("context", []))
+            log_usage(usage, timer.retrieved)
+            answer, graph_url = await asyncio.to_thread(extract_graph, answer)
+            return {"text": answer, "graph_url": graph_url,
+                    "sources": source_metadata(result.get("context", [])), "usage": usage}
         
-        # Grafik kontrolü (opsiyonel - eğer LLM JSON döndürürse)
-        graph_image_base64 = None
-        try:
-            # Eğer yanıt JSON formatında grafik verisi içeriyorsa
-            data = json.loads(answer)
-            if data.get("type") == "graph":
-                y = data.get("data", [])
-                plt.figure()
-                plt.plot(y)
-                buf = io.BytesIO()
-                plt.savefig(buf, format="png")
-                buf.seek(0)
-                graph_image_base64 = base64.b64encode(buf.read()).decode("utf-8")
-                plt.close()
-        except:
-            # JSON değilse, GRAPH: formatını kontrol et
-            if "GRAPH:" in answer:
-                try:
-                    import re, ast
-                    graph_line = re.search(r'GRAPH:\s*\[.*?\],\s*\[.*?\]', answer)
-                    if graph_line:
-                        coords = graph_line.group().replace("GRAPH:", "").strip()
-                        x_vals, y_vals = ast.literal_eval(f"[{coords}]")
-                        
-                        plt.figure(figsize=(8, 6))
-                        plt.plot(x_vals, y_vals, marker='o')
-                        plt.grid(True)
-                        plt.title("Grafik")
-                        
-                        buf = io.BytesIO()
-                        plt.savefig(buf, format="png", bbox_inches='tight')
-                        buf.seek(0)
-                        graph_image_base64 = base64.b64encode(buf.read()).decode("utf-8")
-                        plt.close()
-                        print("📊 Grafik oluşturuldu")
-                        
-                        # GRAPH satırını temizle
-                        answer = re.sub(r'GRAPH:\s*\[.*?\],\s*\[.*?\]', '', answer).strip()
-                except Exception as graph_error:
-                    print(f"⚠️ Grafik oluşturulamadı: {graph_error}")
-
-        return {"text": answer, "graph_image": graph_image_base64}
+        # Aynı anda gelen aynı bağımsız sorular tek chain çalışmasını paylaşır
+        key = ("message", version, scope, normalize_question(message.name)) if version is not None else None
+        response, coalesced = await governor.run(run_chain, key=key)
+        if coalesced:
+            await asyncio.to_thread(get_session_history(session_id).add_messages,
+                                    [HumanMessage(content=message.name), AIMessage(content=response["text"])])
+        await store_cached_answer(message.name, version, response, scope)
+        return {**response, "cached": False, "coalesced": coalesced}
 
+    except (LLMSaturated, HTTPException):
+        raise
     except Exception as e:
-        print(f"❌ Sohbet hatası: {e}")
+        log(f"❌ Sohbet hatası: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/upload-pdf")
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Streaming mesaj endpoint (Server-Sent Events)
+# Olay sırası: sources -> token* -> graph (varsa) -> done | error
+@app.post("/message/stream")
+async def stream_request(message: Message):
+    log(f"💬 Soru alındı (stream): {message.name}")
+    chain = require_chain()
+    session_id = resolve_session_id(message)
+    allowed_sources = await asyncio.to_thread(resolve_sources, message)
+    scope = "|".join(allowed_sources or [])
+
+    version, cached = await lookup_cached_answer(message.name, session_id, scope)
+    if cached is not None:
+        async def cached_events():
+            yield sse_event("sources", cached["sources"])
+            yield sse_event("token", {"text": cached["text"]})
+            if cached.get("graph_url"):
+                yield sse_event("graph", {"graph_url": cached["graph_url"]})
+            yield sse_event("done", {"text": cached["text"], "usage": CACHED_USAGE, "cached": True})
+        return StreamingResponse(cached_events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def generate():
+        # Tek chain çalışması; governor parçaları aynı soruyu bekleyen tüm akışlara dağıtır
+        answer = ""
+        sources = []
+        context_docs = []
+        usage_handler = UsageMetadataCallbackHandler()
+        timer = StageTimer()
+        chain_started = time.perf_counter()
+        async for chunk in chain.astream(
+            chain_input(message, allowed_sources),
+            config={"configurable": {"session_id": session_id}, "callbacks": [usage_handler, timer]}
+        ):
+            if "context" in chunk:
+                context_docs = chunk["context"]
+                sources = source_metadata(context_docs)
+                yield {"sources": sources}
+            token = chunk.get("answer")
+            if token:
+                answer += token
+                yield {"token": token}
+        record_stage("chain", time.perf_counter() - chain_started)
+        usage = usage_summary(usage_handler.usage_metadata, context_docs)
+        log_usage(usage, timer.retrieved)
+        text, graph_url = await asyncio.to_thread(extract_graph, answer)
+        result = {"text": text, "graph_url": graph_url, "sources": sources}
+        await store_cached_answer(message.name, version, result, scope)
+        yield {"done": {**result, "usage": usage}}
+
+    # Aynı anda gelen aynı bağımsız sorular tek akışı paylaşır; ilk token'dan önceki 429'lar tekrar denenir.
+    # Slot burada alınır: doygunlukta istemci akış başlamadan 503 alır.
+    key = ("message", version, scope, normalize_question(message.name)) if version is not None else None
+    items, coalesced = await governor.open_stream(generate, key=key, committed=lambda item: "token" in item)
+
+    async def events():
+        try:
+            async for item in items:
+                if "sources" in item:
+                    yield sse_event("sources", item["sources"])
+                elif "token" in item:
+                    yield sse_event("token", {"text": item["token"]})
+                elif "done" in item:
+                    result = item["done"]
+                    if coalesced:
+                        await asyncio.to_thread(get_session_history(session_id).add_messages,
+                                                [HumanMessage(content=message.name), AIMessage(content=result["text"])])
+                    if result["graph_url"]:
+                        yield sse_event("graph", {"graph_url": result["graph_url"]})
+                    yield sse_event("done", {"text": result["text"], "usage": result["usage"], "cached": False,
+                                             "coalesced": coalesced})
+        except Exception as e:
+            log(f"❌ Sohbet hatası (stream): {e}")
+            yield sse_event("error", {"detail": str(e),
+                                      "rate_limited": isinstance(e, LLMSaturated) or is_rate_limited(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def receive_upload(file: UploadFile, max_bytes: int) -> tuple:
+    try:
+        return await run_blocking(io_executor, copy_upload, file.file, UPLOAD_DIR, max_bytes)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        await file.close()
+
+def schedule_optimize():
+    # Silinen noktaların vacuum'u Qdrant'ta arka planda sürer; istek beklemez
+    threading.Thread(target=optimize_collection, daemon=True).start()
+
+def submit_job(kind: str, filename: str, fn, *args):
+    try:
+        return jobs.submit(kind, filename, fn, *args)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"İşleme kuyruğu dolu: {e}", headers={"Retry-After": "10"})
+
+def previous_versions(path: str) -> list:
+    # Yükleme alındığı anda registry'de kayıtlı, aynı orijinal adlı sürümler. Diskteki ya da hâlâ
+    # ingest edilen dosyalara bakılmaz; aynı anda gelen iki yükleme birbirini silemez.
+    name = display_name(path)
+    return sorted(f["source"] for f in registry.list_files()
+                  if f["source"] != path and os.path.dirname(f["source"]) == os.path.dirname(path)
+                  and display_name(f["source"]) == name)
+
+def run_pdf_job(file_path: str, previous: list, progress):
+    result = ingest_pdf(file_path, progress=progress)
+    # Yeni sürüm commit edildikten sonra sadece yükleme anındaki eski sürümler kaldırılır
+    stale = [source for source in previous if source != file_path]
+    result["chunks_removed"] = result.get("chunks_removed", 0) + remove_documents(stale)
+    result["superseded"] = [os.path.basename(source) for source in stale]
+    refresh_chains()
+    if stale:
+        schedule_optimize()
+    return result
+
+@app.post("/upload-pdf", status_code=202)
 async def upload_pdf(file: UploadFile = File(...)):
-    if not file.filename.endswith(".pdf"):
+    if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Sadece PDF kabul edilir")
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    success = ingest_from_docs(UPLOAD_DIR)
-    if not success:
-        raise HTTPException(status_code=500, detail="PDF işlenemedi")
-    global retriever
-    retriever = get_retriever()
-    initialize_chains()
-    return {"status":"success","filename":file.filename,"size_bytes":len(content),
-            "message":f"{file.filename} başarıyla yüklendi ve işlendi"}
-
-@app.post("/upload-image")
+    part_path, file_hash, size = await receive_upload(file, MAX_PDF_BYTES)
+    file_path = await run_blocking(io_executor, finalize_upload, part_path, UPLOAD_DIR, file_hash, file.filename)
+    previous = await asyncio.to_thread(previous_versions, file_path)
+    job = submit_job("pdf", file.filename, run_pdf_job, file_path, previous)
+    return {"status":"queued","job_id":job["id"],"filename":file.filename,"size_bytes":size,
+            "stored_as":os.path.basename(file_path),"message":f"{file.filename} yüklendi, işleniyor"}
+
+def run_image_job(part_path: str, file_hash: str, phash: int, filename: str, progress):
+    # Küçültme iş thread'inde yapılır; OCR ve vision çağrısı sınırlı çözünürlükteki JPEG'i kullanır
+    file_path = normalize_image(part_path, UPLOAD_DIR, file_hash, filename)
+    ocr_text = ingest_from_image(file_path, progress=progress)
+    if ocr_text is None:
+        raise RuntimeError("Görsel işlenemedi")
+    refresh_chains()
+
+    with open(file_path, "rb") as img_file:
+        image_data = base64.b64encode(img_file.read()).decode("utf-8")
+    
+    from langchain_core.messages import HumanMessage
+    
+    # Görsel analizi
+    analysis_message = HumanMessage(
+        content=[
+            {
+                "type": "text", 
+                "text": """Bu görseli detaylı analiz et. 
+                Eğer bir matematik sorusu varsa adım adım çöz.
+                Eğer bir grafik çizilmesi gerekiyorsa, son satırda şu formatlardan biriyle belirt:
+                GRAPH: f(x) = <ifade>, [başlangıç, bitiş]
+                GRAPH: [x_değerleri], [y_değerleri]
+                Örnek: GRAPH: f(x) = x**2, [0, 4]
+                """
+            },
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}
+            }
+        ]
+    )
+    
+    with stage("vision"):
+        response = call_llm_from_thread(lambda: llm.ainvoke([analysis_message]))
+    analysis_text = response.content
+    
+    log(f"✅ Analiz: {analysis_text[:200]}...")
+    
+    # Grafik verisi var mı kontrol et
+    analysis_text, graph_url = extract_graph(analysis_text)
+    
+    result = {
+        "status": "success",
+        "message": "Görsel başarıyla analiz edildi",
+        "analysis": analysis_text,
+        "graph_url": graph_url,
+        "filename": filename
+    }
+    image_cache.put(file_hash, phash, file_path, {**result, "ocr_text": ocr_text})
+    return result
+
+@app.post("/upload-image", status_code=202)
 async def analyze_image(file: UploadFile = File(...)):
-    print(f"📸 Görsel alındı: {file.filename}")
+    log(f"📸 Görsel alındı: {file.filename}")
     
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Sadece görsel yükleyin")
     
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    success = ingest_from_image(file_path)
-    if not success:
-        raise HTTPException(status_code=500, detail="Görsel işlenemedi")
-    
+    part_path, file_hash, size = await receive_upload(file, MAX_IMAGE_BYTES)
     try:
-        with open(file_path, "rb") as img_file:
-            image_data = base64.b64encode(img_file.read()).decode("utf-8")
-        
-        from langchain_core.messages import HumanMessage
-        
-        # Görsel analizi
-        analysis_message = HumanMessage(
-            content=[
-                {
-                    "type": "text", 
-                    "text": """Bu görseli detaylı analiz et. 
-                    Eğer bir matematik sorusu varsa adım adım çöz.
-                    Eğer bir grafik çizilmesi gerekiyorsa, son satırda şu formatta belirt:
-                    GRAPH: [x_değerleri], [y_değerleri]
-                    Örnek: GRAPH: [0,1,2,3,4], [0,1,4,9,16]
-                    """
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}
-                }
-            ]
-        )
-        
-        response = llm.invoke([analysis_message])
-        analysis_text = response.content
-        
-        print(f"✅ Analiz: {analysis_text[:200]}...")
-        
-        # Grafik verisi var mı kontrol et
-        graph_image_base64 = None
-        if "GRAPH:" in analysis_text:
-            try:
-                import re
-                import ast
-                
-                # GRAPH: satırını bul
-                graph_line = re.search(r'GRAPH:\s*\[.*?\],\s*\[.*?\]', analysis_text)
-                if graph_line:
-                    # Verileri parse et
-                    coords = graph_line.group().replace("GRAPH:", "").strip()
-                    x_vals, y_vals = ast.literal_eval(f"[{coords}]")
-                    
-                    # Grafik çiz
-                    plt.figure(figsize=(8, 6))
-                    plt.plot(x_vals, y_vals, marker='o')
-                    plt.grid(True)
-                    plt.title("Grafik")
-                    
-                    buf = io.BytesIO()
-                    plt.savefig(buf, format="png", bbox_inches='tight')
-                    buf.seek(0)
-                    graph_image_base64 = base64.b64encode(buf.read()).decode("utf-8")
-                    plt.close()
-                    
-                    print("📊 Grafik oluşturuldu")
-                    
-                    # GRAPH satırını temizle
-                    analysis_text = re.sub(r'GRAPH:\s*\[.*?\],\s*\[.*?\]', '', analysis_text).strip()
-            except Exception as graph_error:
-                print(f"⚠️ Grafik oluşturulamadı: {graph_error}")
-        
-        return {
-            "status": "success",
-            "message": "Görsel başarıyla analiz edildi",
-            "analysis": analysis_text,
-            "graph_image": graph_image_base64,
-            "filename": file.filename
-        }
-        
-    except Exception as e:
-        print(f"❌ Hata: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Analiz hatası: {str(e)}")
\ No newline at end of file
+        phash = await run_blocking(io_executor, dhash, part_path)
+    except Exception:
+        os.remove(part_path)
+        raise HTTPException(status_code=400, detail="Görsel okunamadı")
+
+    def same_text(candidate: dict) -> bool:
+        # Hash'i yakın aday ancak OCR metni de tutarsa kullanılır; OCR cache'i içerik hash'iyle
+        # tutulduğu için reddedilirse kuyruktaki iş bu metni tekrar çıkarmaz
+        try:
+            text = get_ocr_executor().submit(ocr_image_file, part_path).result()
+        except Exception as e:
+            log(f"⚠️ Yakın eş OCR kontrolü başarısız: {e}")
+            return False
+        return text_matches(text or "", candidate.get("ocr_text") or "")
+
+    # Aynı ya da çok benzer görsel daha önce analiz edildiyse embedding ve vision çağrısı yapılmaz
+    cached = await asyncio.to_thread(image_cache.get, file_hash, phash, same_text)
+    cache_event("image", cached is not None)
+    if cached is not None:
+        os.remove(part_path)
+        log(f"⚡ Görsel cache'ten döndü (eşi: {cached['duplicate_of']})")
+        cached.pop("ocr_text", None)
+        return JSONResponse(status_code=200, content={**cached, "filename": file.filename, "cached": True})
+
+    try:
+        job = submit_job("image", file.filename, run_image_job, part_path, file_hash, phash, file.filename)
+    except HTTPException:
+        os.remove(part_path)
+        raise
+    return {"status": "queued", "job_id": job["id"], "filename": file.filename, "size_bytes": size,
+            "message": "Görsel alındı, analiz ediliyor"}
+
+def document_entry(entry: dict) -> dict:
+    return {
+        "name": display_name(entry["source"]),
+        "stored_as": os.path.basename(entry["source"]),
+        "doc_type": entry["doc_type"],
+        "chunk_count": entry["chunk_count"],
+        "size_bytes": entry["size"],
+        "ingested_at": entry["ingested_at"],
+    }
+
+def find_documents(name: str) -> list:
+    # Saklanan ad (hash önekli) tek sürümü, orijinal ad o adla yüklenmiş tüm sürümleri seçer
+    sources = sorted(f["source"] for f in registry.list_files()
+                     if os.path.basename(f["source"]) == name or display_name(f["source"]) == name)
+    if not sources:
+        raise HTTPException(status_code=404, detail="Doküman bulunamadı")
+    return sources
+
+def remove_documents(sources: list) -> int:
+    # Noktalar, lexical indeks, registry kaydı, dosya ve görsel cache kaydı birlikte silinir.
+    # Registry sürümü artar: retriever yeniden kurulur, cevap cache'i tüm worker'larda geçersizleşir.
+    removed = 0
+    for source in sources:
+        removed += delete_source(source)
+        image_cache.forget_source(source)
+        log(f"🗑️  {os.path.basename(source)} silindi")
+    return removed
+
+def run_replace_job(part_path: str, file_hash: str, filename: str, is_image: bool, old_sources: list, progress):
+    # Eski sürüm, yenisi tamamen indekslenene kadar aramada kalır; doküman hiçbir an kaybolmaz
+    if is_image:
+        file_path = normalize_image(part_path, UPLOAD_DIR, file_hash, filename)
+        if ingest_from_image(file_path, progress=progress) is None:
+            raise RuntimeError("Görsel işlenemedi")
+        result = {}
+    else:
+        file_path = finalize_upload(part_path, UPLOAD_DIR, file_hash, filename)
+        result = ingest_pdf(file_path, progress=progress)
+    stale = [source for source in old_sources if source != file_path]
+    result["chunks_removed"] = result.get("chunks_removed", 0) + remove_documents(stale)
+    result["replaced"] = [os.path.basename(source) for source in stale]
+    result["stored_as"] = os.path.basename(file_path)
+    refresh_chains()
+    schedule_optimize()
+    return result
+
+@app.get("/documents")
+def list_documents():
+    documents = [document_entry(f) for f in registry.list_files()]
+    return {
+        "documents": documents,
+        "total_chunks": sum(d["chunk_count"] for d in documents),
+        "total_bytes": sum(d["size_bytes"] for d in documents),
+        "index_version": registry.get_version(),
+    }
+
+@app.delete("/documents/{name}")
+def delete_document(name: str):
+    sources = find_documents(name)
+    removed = remove_documents(sources)
+    refresh_chains()
+    schedule_optimize()
+    return {"status": "deleted", "deleted": [os.path.basename(s) for s in sources], "chunks_removed": removed}
+
+@app.put("/documents/{name}", status_code=202)
+async def replace_document(name: str, file: UploadFile = File(...)):
+    sources = await asyncio.to_thread(find_documents, name)
+    is_image = (file.content_type or "").startswith("image/")
+    if not is_image and not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Sadece PDF ya da görsel kabul edilir")
+    part_path, file_hash, size = await receive_upload(file, MAX_IMAGE_BYTES if is_image else MAX_PDF_BYTES)
+    try:
+        job = submit_job("replace", file.filename, run_replace_job, part_path, file_hash, file.filename,
+                         is_image, sources)
+    except HTTPException:
+        os.remove(part_path)
+        raise
+    return {"status": "queued", "job_id": job["id"], "filename": file.filename, "size_bytes": size,
+            "replaces": [os.path.basename(s) for s in sources],
+            "message": f"{file.filename} yüklendi, eski sürüm indeksleme bitince kaldırılacak"}
+
+@app.delete("/sessions/{session_id}")
+def clear_session(session_id: str):
+    if not SESSION_ID_RE.match(session_id):
+        raise HTTPException(status_code=400, detail="Geçersiz session_id")
+    session_store.clear(session_id)
+    return {"status": "cleared", "session_id": session_id}
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/graphs/{graph_id}")
+def get_graph(graph_id: str):
+    # id çizim tanımının hash'i: içerik hiç değişmez, istemci sonsuza dek cache'leyebilir
+    path = graph_path(graph_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Grafik bulunamadı")
+    return FileResponse(path, media_type="image/png",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="İş bulunamadı")
+    return job
@@ -0,0 +1,269 @@
+import os
+import io
+import re
+import ast
+import json
+import glob
+import hashlib
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from ingest_registry import STATE_DIR
+
+GRAPH_WORKERS = int(os.getenv("GRAPH_WORKERS", "2"))
+GRAPH_CACHE_DIR = os.getenv("GRAPH_CACHE_DIR", os.path.join(STATE_DIR, "graphs"))
+GRAPH_CACHE_MAX_FILES = int(os.getenv("GRAPH_CACHE_MAX_FILES", "2000"))
+# Budanan PNG'ler spec'ten yeniden çizilir; spec'ler görsel (5000) ve cevap cache'lerinin URL'lerinden uzun yaşar
+GRAPH_SPEC_MAX_FILES = int(os.getenv("GRAPH_SPEC_MAX_FILES", "20000"))
+# Fonksiyon ifadeleri tanım aralığında bu kadar noktada örneklenir
+GRAPH_SAMPLES = int(os.getenv("GRAPH_SAMPLES", "500"))
+GRAPH_MAX_POINTS = int(os.getenv("GRAPH_MAX_POINTS", "10000"))
+GRAPH_MAX_SERIES = int(os.getenv("GRAPH_MAX_SERIES", "5"))
+GRAPH_MAX_EXPR_LEN = 200
+GRAPH_DPI = int(os.getenv("GRAPH_DPI", "100"))
+
+# GRAPH: [x1,x2,...], [y1,y2,...]
+_POINTS_RE = re.compile(r"GRAPH:\s*\[([^\[\]]*)\],\s*\[([^\[\]]*)\]")
+# GRAPH: f(x) = x**2 - 3*x, [-5, 5]   (y = ... da olur)
+_FUNCTION_RE = re.compile(r"GRAPH:\s*(?:\w+\(x\)|y)\s*=\s*(.+),\s*\[([^\[\]]+)\][ \t]*$", re.MULTILINE)
+_GRAPH_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# İfadelerde izin verilen isimler; geri kalan her şey (attribute, subscript, lambda...) reddedilir
+_FUNCTIONS = {
+    "sin": np.sin, "cos": np.cos, "tan": np.tan,
+    "arcsin": np.arcsin, "arccos": np.arccos, "arctan": np.arctan,
+    "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan,
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh,
+    "exp": np.exp, "log": np.log, "ln": np.log, "log10": np.log10, "log2": np.log2,
+    "sqrt": np.sqrt, "abs": np.abs, "floor": np.floor, "ceil": np.ceil, "sign": np.sign,
+}
+_CONSTANTS = {"pi": np.pi, "e": np.e}
+_BIN_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv)
+_UNARY_OPS = (ast.UAdd, ast.USub)
+
+stats = Counter()
+_stats_lock = threading.Lock()
+_executor = None
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(stats)
+
+
+def _count(field: str):
+    with _stats_lock:
+        stats[field] += 1
+
+
+def get_render_executor():
+    # Agg çizimi CPU yoğun; GIL'e takılmasın diye ayrı process'lerde çalışır
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=GRAPH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def compile_expression(expr: str, variables=("x",)):
+    # Sadece sayılar, izinli isimler, aritmetik ve izinli fonksiyon çağrıları
+    expr = expr.strip().replace("^", "**").replace("−", "-")
+    if not expr or len(expr) > GRAPH_MAX_EXPR_LEN:
+        raise ValueError("İfade boş ya da çok uzun")
+    tree = ast.parse(expr, mode="eval")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                raise ValueError(f"Geçersiz sabit: {node.value!r}")
+            # Tam sayı üs alma (10**10**10) Python'da sınırsız büyür; float taşması hata verir
+            node.value = float(node.value)
+        elif isinstance(node, ast.Name):
+            if node.id not in variables and node.id not in _CONSTANTS and node.id not in _FUNCTIONS:
+                raise ValueError(f"Bilinmeyen isim: {node.id}")
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS or node.keywords:
+                raise ValueError("Sadece izinli fonksiyonlar çağrılabilir")
+        elif isinstance(node, ast.BinOp):
+            if not isinstance(node.op, _BIN_OPS):
+                raise ValueError("Geçersiz operatör")
+        elif isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, _UNARY_OPS):
+                raise ValueError("Geçersiz operatör")
+        elif not isinstance(node, (ast.Expression, ast.Load) + _BIN_OPS + _UNARY_OPS):
+            raise ValueError(f"İzin verilmeyen ifade: {type(node).__name__}")
+    return compile(tree, "<graph>", "eval")
+
+
+def evaluate(code, **variables):
+    with np.errstate(all="ignore"):
+        return eval(code, {"__builtins__": {}}, {**_FUNCTIONS, **_CONSTANTS, **variables})
+
+
+def sample_function(expr: str, domain: list, samples: int = GRAPH_SAMPLES):
+    # Tüm aralık tek bir vektörel NumPy çağrısıyla hesaplanır; tanımsız noktalar boşluk olarak çizilir
+    x = np.linspace(domain[0], domain[1], samples)
+    y = np.broadcast_to(np.asarray(evaluate(compile_expression(expr), x=x), dtype=np.float64), x.shape).copy()
+    y[~np.isfinite(y)] = np.nan
+    # Dikey asimptotlarda (tan, 1/x) uçları birleştiren çizgiyi kır
+    finite = y[np.isfinite(y)]
+    if finite.size:
+        low, high = np.percentile(finite, [2, 98])
+        span = max(high - low, 1e-9)
+        y[(y < low - 5 * span) | (y > high + 5 * span)] = np.nan
+    return x, y
+
+
+def _parse_number(text: str) -> float:
+    # 1/0 ZeroDivisionError, 10**400 OverflowError verir; çağıran bunları okunamayan grafik sayar
+    value = float(evaluate(compile_expression(text, variables=())))
+    if not np.isfinite(value):
+        raise ValueError(f"Geçersiz sayı: {text}")
+    return value
+
+
+def _parse_list(text: str) -> list:
+    return [_parse_number(item) for item in text.split(",") if item.strip()]
+
+
+def parse_graph(answer: str):
+    # Cevaptaki GRAPH satırlarını tek bir çizim tanımına çevirir ve metinden çıkarır.
+    # Dönüş: (temizlenmiş cevap, spec ya da None)
+    series = []
+    try:
+        # LLM bazen {"type": "graph", "data": [...]} JSON'u döndürür
+        data = json.loads(answer)
+        if isinstance(data, dict) and data.get("type") == "graph":
+            y = [float(v) for v in data.get("data", [])][:GRAPH_MAX_POINTS]
+            return "", {"series": [{"kind": "points", "x": list(range(len(y))), "y": y}]}
+    except (ValueError, TypeError, ArithmeticError):
+        pass
+
+    for match in _FUNCTION_RE.finditer(answer):
+        expr, domain_text = match.group(1).strip(), match.group(2)
+        try:
+            compile_expression(expr)
+            domain = _parse_list(domain_text)
+            if len(domain) != 2 or domain[0] >= domain[1]:
+                raise ValueError(f"Geçersiz aralık: [{domain_text}]")
+            series.append({"kind": "function", "expr": expr, "domain": domain})
+        except (ValueError, SyntaxError, ArithmeticError) as e:
+            print(f"⚠️ Grafik ifadesi okunamadı ({expr}): {e}")
+    for match in _POINTS_RE.finditer(answer):
+        try:
+            x, y = _parse_list(match.group(1)), _parse_list(match.group(2))
+            if not y or (x and len(x) != len(y)):
+                raise ValueError("x ve y uzunlukları farklı")
+            x = x or list(range(len(y)))
+            series.append({"kind": "points", "x": x[:GRAPH_MAX_POINTS], "y": y[:GRAPH_MAX_POINTS]})
+        except (ValueError, SyntaxError, ArithmeticError) as e:
+            print(f"⚠️ Grafik verisi okunamadı: {e}")
+
+    if not series:
+        return answer, None
+    cleaned = re.sub(r"\n{3,}", "\n\n", _POINTS_RE.sub("", _FUNCTION_RE.sub("", answer))).strip()
+    return cleaned, {"series": series[:GRAPH_MAX_SERIES]}
+
+
+def graph_id(spec: dict) -> str:
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{canonical}|{GRAPH_SAMPLES}|{GRAPH_DPI}".encode()).hexdigest()[:32]
+
+
+def _spec_path(gid: str) -> str:
+    return os.path.join(GRAPH_CACHE_DIR, f"{gid}.json")
+
+
+def _save_spec(gid: str, spec: dict):
+    path = _spec_path(gid)
+    if os.path.exists(path):
+        os.utime(path)
+        return
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(spec, f)
+    os.replace(tmp_path, path)
+
+
+def graph_path(gid: str):
+    if not _GRAPH_ID_RE.match(gid):
+        return None
+    path = os.path.join(GRAPH_CACHE_DIR, f"{gid}.png")
+    if os.path.exists(path):
+        return path
+    # PNG budanmış olabilir; görsel/cevap cache'lerindeki graph_url'ler hâlâ bu id'yi verir
+    try:
+        with open(_spec_path(gid)) as f:
+            spec = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    get_render_executor().submit(_render_to_file, spec, path).result()
+    _count("rerendered")
+    return path
+
+
+def render_png(spec: dict) -> bytes:
+    # pyplot'un global durumu yerine her çizim kendi Figure/Agg canvas'ına sahip
+    fig = Figure(figsize=(8, 6), dpi=GRAPH_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    labelled = len(spec["series"]) > 1
+    for item in spec["series"]:
+        if item["kind"] == "function":
+            x, y = sample_function(item["expr"], item["domain"])
+            ax.plot(x, y, label=f"y = {item['expr']}")
+            ax.axhline(0, color="gray", linewidth=0.8)
+            ax.axvline(0, color="gray", linewidth=0.8)
+        else:
+            ax.plot(item["x"], item["y"], marker="o", label=f"{len(item['y'])} nokta")
+    ax.grid(True)
+    ax.set_title(spec.get("title") or (f"y = {spec['series'][0]['expr']}"
+                                       if not labelled and spec["series"][0]["kind"] == "function" else "Grafik"))
+    if labelled:
+        ax.legend()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+
+def _render_to_file(spec: dict, path: str):
+    # Process pool'da çalışır; yarım dosya görülmesin diye önce geçici ada yazılır
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(render_png(spec))
+    os.replace(tmp_path, path)
+
+
+def _prune(pattern: str, limit: int):
+    files = glob.glob(os.path.join(GRAPH_CACHE_DIR, pattern))
+    if len(files) <= limit:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - limit]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def render_graph(spec: dict) -> str:
+    # Aynı spec aynı id'yi verir; PNG varsa tekrar çizilmez
+    gid = graph_id(spec)
+    path = os.path.join(GRAPH_CACHE_DIR, f"{gid}.png")
+    if os.path.exists(path):
+        os.utime(path)
+        _save_spec(gid, spec)
+        _count("cache_hits")
+        return gid
+    os.makedirs(GRAPH_CACHE_DIR, exist_ok=True)
+    _save_spec(gid, spec)
+    get_render_executor().submit(_render_to_file, spec, path).result()
+    _count("rendered")
+    _prune("*.png", GRAPH_CACHE_MAX_FILES)
+    _prune("*.json", GRAPH_SPEC_MAX_FILES)
+    return gid
@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from difflib import SequenceMatcher
+from PIL import Image, ImageOps
+from ingest_registry import STATE_DIR
+
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", os.path.join(STATE_DIR, "image_cache.db"))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+# 256 bitlik (16x16) dHash'te en fazla bu kadar farklı bit varsa aday sayılır (0 = sadece birebir içerik).
+# Aynı fotoğrafın yeniden kodlanmış/küçültülmüş kopyaları <= 12, farklı fotoğraflar >= 110 bit fark verdi.
+IMAGE_HASH_THRESHOLD = int(os.getenv("IMAGE_HASH_THRESHOLD", "16"))
+# Aynı düzendeki metin sayfaları (farklı sorular) hash'te ayırt edilemez; yakın aday ancak OCR metni
+# bu oranda benziyor ve içindeki sayılar birebir aynıysa kabul edilir
+IMAGE_OCR_SIMILARITY = float(os.getenv("IMAGE_OCR_SIMILARITY", "0.95"))
+DHASH_SIZE = 16
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def dhash(path: str, size: int = DHASH_SIZE) -> int:
+    # Fark hash'i: gri tonlamalı (size+1)x size küçük görselde yan yana piksellerin karşılaştırması.
+    # Yeniden boyutlandırma, JPEG sıkıştırma ve WhatsApp yeniden kodlamasına dayanıklıdır.
+    with Image.open(path) as img:
+        img.draft("L", (size * 16, size * 16))
+        img = ImageOps.exif_transpose(img).convert("L").resize((size + 1, size), Image.LANCZOS)
+        pixels = list(img.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def text_matches(a: str, b: str, threshold: float = IMAGE_OCR_SIMILARITY) -> bool:
+    # Tek bir rakamı farklı iki soru metin olarak neredeyse aynıdır; sayılar ayrıca birebir karşılaştırılır
+    a, b = " ".join(a.lower().split()), " ".join(b.lower().split())
+    if _NUMBER_RE.findall(a) != _NUMBER_RE.findall(b):
+        return False
+    return SequenceMatcher(None, a, b, autojunk=False).ratio() >= threshold
+
+
+class ImageResultCache:
+    # Görsel analizi sonuçları (OCR metni, analiz, grafik) perceptual hash ile saklanır;
+    # aynı/çok benzer fotoğraf tekrar yüklendiğinde OCR, embedding ve vision çağrısı atlanır
+    def __init__(self, path: str = IMAGE_CACHE_PATH, threshold: int = IMAGE_HASH_THRESHOLD,
+                 max_entries: int = IMAGE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_near = 0
+        self.misses = 0
+        self.near_rejected = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+            if columns and "dhash" not in columns:
+                # 64 bitlik eski hash'ler yenileriyle karşılaştırılamaz; cache baştan kurulur
+                conn.execute("DROP TABLE images")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS images (
+                    file_hash TEXT PRIMARY KEY,
+                    dhash TEXT NOT NULL,
+                    source TEXT,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_images_last_used ON images(last_used);
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _count(self, field: str):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get(self, file_hash: str, phash: int, confirm=None):
+        # Önce birebir içerik, sonra Hamming mesafesi eşik altındaki en yakın görsel.
+        # confirm(sonuç) verilirse yakın aday ancak True dönerse kullanılır (ör. OCR metni karşılaştırması)
+        with self._connect() as conn:
+            row = conn.execute("SELECT file_hash, result FROM images WHERE file_hash = ?", (file_hash,)).fetchone()
+            field = "hits_exact"
+            if row is None and self.threshold > 0:
+                best = None
+                for candidate_hash, candidate_dhash in conn.execute("SELECT file_hash, dhash FROM images"):
+                    distance = hamming(phash, int(candidate_dhash, 16))
+                    if distance <= self.threshold and (best is None or distance < best[0]):
+                        best = (distance, candidate_hash)
+                if best is not None:
+                    row = conn.execute("SELECT file_hash, result FROM images WHERE file_hash = ?",
+                                       (best[1],)).fetchone()
+                    field = "hits_near"
+        if row is None:
+            self._count("misses")
+            return None
+        result = json.loads(row[1])
+        if field == "hits_near" and confirm is not None and not confirm(result):
+            self._count("near_rejected")
+            self._count("misses")
+            return None
+        with self._connect() as conn:
+            conn.execute("UPDATE images SET last_used = ? WHERE file_hash = ?", (time.time(), row[0]))
+        self._count(field)
+        return {**result, "duplicate_of": row[0][:16]}
+
+    def put(self, file_hash: str, phash: int, source: str, result: dict):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO images (file_hash, dhash, source, result, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_hash, f"{phash:0{DHASH_SIZE * DHASH_SIZE // 4}x}", source,
+                 json.dumps(result, ensure_ascii=False), now, now),
+            )
+            conn.execute(
+                "DELETE FROM images WHERE file_hash NOT IN "
+                "(SELECT file_hash FROM images ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def forget_source(self, source: str) -> int:
+        # Doküman silindiğinde aynı görsel tekrar yüklenirse cache'ten dönmeyip yeniden indekslenmeli
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM images WHERE source = ?", (source,)).rowcount
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return {"entries": entries, "hits_exact": self.hits_exact, "hits_near": self.hits_near,
+                "near_rejected": self.near_rejected, "misses": self.misses, "threshold": self.threshold}
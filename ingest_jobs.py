@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import traceback
+import contextvars
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from ingest_registry import STATE_DIR
+
+JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+# Worker başına kuyrukta/çalışan en fazla iş
+JOB_QUEUE_LIMIT = int(os.getenv("INGEST_JOB_QUEUE_LIMIT", "16"))
+JOB_HISTORY_LIMIT = int(os.getenv("INGEST_JOB_HISTORY_LIMIT", "200"))
+JOB_DB_PATH = os.getenv("INGEST_JOB_DB_PATH", os.path.join(STATE_DIR, "jobs.db"))
+# İlerleme en fazla bu aralıkla diske yazılır
+JOB_FLUSH_INTERVAL = float(os.getenv("INGEST_JOB_FLUSH_INTERVAL", "0.5"))
+
+PROGRESS_FIELDS = ("pages_total", "pages_parsed", "pages_ocr", "chunks_total", "chunks_embedded", "points_upserted")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    # İşler bu süreçte çalışır, durumları SQLite'a yazılır;
+    # böylece /jobs/{id} hangi uvicorn worker'ına düşerse düşsün cevaplanır
+    def __init__(self, workers: int = JOB_WORKERS, queue_limit: int = JOB_QUEUE_LIMIT, path: str = JOB_DB_PATH):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-job")
+        self.queue_limit = queue_limit
+        self.path = path
+        self.jobs = {}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    worker_pid INTEGER
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _active_count(self) -> int:
+        return sum(1 for job in self.jobs.values() if job["status"] in ("queued", "running"))
+
+    def _save(self, job: dict):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, kind, filename, status, progress, result, error, "
+                "created_at, started_at, finished_at, worker_pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["kind"], job["filename"], job["status"], json.dumps(job["progress"]),
+                 json.dumps(job["result"], default=str), job["error"], job["created_at"],
+                 job["started_at"], job["finished_at"], os.getpid()),
+            )
+
+    def _snapshot(self, job: dict) -> dict:
+        with self.lock:
+            return {**job, "progress": dict(job["progress"])}
+
+    def _flush(self, job: dict):
+        self._save(self._snapshot(job))
+        job["_flushed_at"] = time.time()
+
+    def _prune(self):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND id NOT IN "
+                "(SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY finished_at DESC LIMIT ?)",
+                (JOB_HISTORY_LIMIT,),
+            )
+
+    def submit(self, kind: str, filename: str, fn, *args) -> dict:
+        # fn(*args, progress=callback) çağrılır, dönüş değeri job sonucu olur
+        with self.lock:
+            if self._active_count() >= self.queue_limit:
+                raise JobQueueFull(f"{self.queue_limit} iş zaten kuyrukta")
+            job = {
+                "id": uuid4().hex,
+                "kind": kind,
+                "filename": filename,
+                "status": "queued",
+                "progress": {field: 0 for field in PROGRESS_FIELDS},
+                "result": None,
+                "error": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self.jobs[job["id"]] = job
+        self._flush(job)
+        # İsteğin context'i (request id) iş thread'ine taşınır; iş logları isteğe bağlanabilir
+        context = contextvars.copy_context()
+        self.executor.submit(context.run, self._run, job, fn, args)
+        return self._public(job)
+
+    def _progress_callback(self, job: dict):
+        def progress(**increments):
+            with self.lock:
+                for field, value in increments.items():
+                    job["progress"][field] = job["progress"].get(field, 0) + value
+            if time.time() - job.get("_flushed_at", 0) >= JOB_FLUSH_INTERVAL:
+                self._flush(job)
+        return progress
+
+    def _run(self, job: dict, fn, args):
+        with self.lock:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+        self._flush(job)
+        try:
+            result = fn(*args, progress=self._progress_callback(job))
+            with self.lock:
+                job["result"] = result
+                job["status"] = "done"
+        except Exception as e:
+            print(f"❌ İş başarısız ({job['kind']} {job['filename']}): {e}")
+            traceback.print_exc()
+            with self.lock:
+                job["error"] = str(e)
+                job["status"] = "failed"
+        finally:
+            with self.lock:
+                job["finished_at"] = time.time()
+            try:
+                self._flush(job)
+                self._prune()
+            finally:
+                with self.lock:
+                    self.jobs.pop(job["id"], None)
+
+    @staticmethod
+    def _public(job: dict) -> dict:
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def get(self, job_id: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return self._public({**job, "progress": dict(job["progress"])})
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, filename, status, progress, result, error, created_at, started_at, "
+                "finished_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "kind": row[1], "filename": row[2], "status": row[3],
+            "progress": json.loads(row[4]), "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6], "created_at": row[7], "started_at": row[8], "finished_at": row[9],
+        }
@@ -0,0 +1,119 @@
+import os
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pymupdf
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+from ocr import needs_ocr, ocr_pdf_page
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 2)))
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+# Metin katmanı olmayan (taranmış) sayfalar parse worker'ında OCR'lanır
+OCR_SCANNED_PAGES = os.getenv("OCR_SCANNED_PAGES", "true").lower() == "true"
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+# Kapak/içindekiler/önsöz sayfaları chunk metadata'sında "section" ile işaretlenir
+FRONT_MATTER_PAGES = int(os.getenv("FRONT_MATTER_PAGES", "12"))
+COVER_MAX_WORDS = int(os.getenv("COVER_MAX_WORDS", "80"))
+TOC_MARKERS = ("içindekiler", "icindekiler", "table of contents", "contents")
+PREFACE_MARKERS = ("önsöz", "onsoz", "sunuş", "teşekkür", "preface", "foreword", "acknowledg")
+BOILERPLATE_SECTIONS = {"cover", "toc", "preface"}
+_TOC_LINE_RE = re.compile(r"(\.{3,}|…+|\s{2,})\s*\d+\s*$")
+
+_executor = None
+
+
+def get_parse_executor():
+    # spawn: uvicorn/gRPC thread'leri varken fork güvenli değil; worker'lar sadece bu modülü yükler
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=INGEST_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def classify_page(text: str, page=None, total_pages=None) -> str:
+    # "İ".lower() birleşik nokta (U+0307) üretir, Türkçe işaretlerle eşleşsin diye atılır
+    lines = [line.strip() for line in text.lower().replace("\u0307", "").splitlines() if line.strip()]
+    head = " ".join(lines[:2])
+    if any(head.startswith(marker) for marker in TOC_MARKERS):
+        return "toc"
+    if len(lines) >= 5 and sum(1 for line in lines if _TOC_LINE_RE.search(line)) / len(lines) >= 0.4:
+        return "toc"
+    if page is not None and page < FRONT_MATTER_PAGES and any(head.startswith(m) for m in PREFACE_MARKERS):
+        return "preface"
+    # Tek sayfalık dokümanın ilk sayfası kapak sayılmaz
+    if page == 0 and total_pages != 1 and len(text.split()) < COVER_MAX_WORDS:
+        return "cover"
+    return "body"
+
+
+def _base_metadata(path: str, doc) -> dict:
+    # PyMuPDFLoader ile aynı anahtarlar, eski chunk'larla uyumlu kalsın
+    meta = {k: v for k, v in (doc.metadata or {}).items() if isinstance(v, (str, int, float))}
+    meta.update({"source": path, "file_path": path, "total_pages": doc.page_count, "type": "pdf"})
+    return meta
+
+
+def _parse_page_range(path: str, start: int, end: int):
+    # Worker process: sayfa aralığını açar, her sayfayı ayrı ayrı böler
+    chunks = []
+    ocr_pages = 0
+    with pymupdf.open(path) as doc:
+        base = _base_metadata(path, doc)
+        for page_number in range(start, end):
+            page = doc[page_number]
+            text = page.get_text()
+            extra = {}
+            if OCR_SCANNED_PAGES and needs_ocr(page):
+                try:
+                    text = ocr_pdf_page(page)
+                    extra = {"ocr": True}
+                    ocr_pages += 1
+                except Exception as e:
+                    print(f"⚠️  {os.path.basename(path)} s.{page_number + 1} OCR yapılamadı: {e}")
+            section = classify_page(text, page_number, doc.page_count)
+            for chunk in text_splitter.split_text(text):
+                chunks.append((chunk, {**base, "page": page_number, "section": section, **extra}))
+    return start, end, chunks, ocr_pages
+
+
+def page_count(path: str) -> int:
+    with pymupdf.open(path) as doc:
+        return doc.page_count
+
+
+def _no_progress(**increments):
+    pass
+
+
+def iter_pdf_chunks(path: str, progress=_no_progress):
+    # Sayfa aralıkları process pool'a dağıtılır, chunk'lar tamamlandıkça akış olarak döner.
+    # Aynı anda en fazla 2 * worker aralık bellekte tutulur.
+    total_pages = page_count(path)
+    progress(pages_total=total_pages)
+    ranges = iter([(start, min(start + PAGES_PER_TASK, total_pages))
+                   for start in range(0, total_pages, PAGES_PER_TASK)])
+    executor = get_parse_executor()
+    max_in_flight = 2 * INGEST_WORKERS
+    pending = set()
+    while True:
+        while len(pending) < max_in_flight:
+            page_range = next(ranges, None)
+            if page_range is None:
+                break
+            pending.add(executor.submit(_parse_page_range, path, *page_range))
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            start, end, chunks, ocr_pages = future.result()
+            progress(pages_parsed=end - start, pages_ocr=ocr_pages)
+            for text, metadata in chunks:
+                yield Document(page_content=text, metadata=metadata)
@@ -0,0 +1,170 @@
+import os
+import time
+import fcntl
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from uuid import UUID, uuid5
+
+STATE_DIR = os.getenv("STATE_DIR", "/tmp/uploads/.state")
+REGISTRY_PATH = os.getenv("INGEST_REGISTRY_PATH", os.path.join(STATE_DIR, "ingest_registry.db"))
+LOCK_DIR = os.path.join(STATE_DIR, "locks")
+
+# Point ID'leri bu namespace altında uuid5 ile üretilir; aynı içerik her zaman aynı ID'yi alır
+POINT_NAMESPACE = UUID("6f1c1c9e-3c1d-4a8e-9a57-5b0b8f0f2d11")
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def point_id(source: str, page, chunk_hash: str, occurrence: int) -> str:
+    # Aynı sayfada aynı metin birden fazla geçebilir, occurrence ile ayrışır
+    return str(uuid5(POINT_NAMESPACE, f"{source}|{page}|{chunk_hash}|{occurrence}"))
+
+
+@contextmanager
+def file_lock(name: str, blocking: bool = True):
+    # Aynı STATE_DIR'i paylaşan uvicorn worker'ları arasında flock tabanlı kilit.
+    # blocking=False ise kilit alınamadığında False verir.
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(os.path.join(LOCK_DIR, f"{name}.lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def source_lock(source: str):
+    # Aynı dosya iki worker'da aynı anda ingest edilmesin
+    return file_lock(f"source-{hash_text(source)[:16]}")
+
+
+class IngestRegistry:
+    def __init__(self, path: str = REGISTRY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    source TEXT PRIMARY KEY,
+                    file_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    doc_type TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    ingested_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    point_id TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    chunk_hash TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _bump_version(self, conn):
+        # Koleksiyon içeriği her değiştiğinde artar; cache'ler bu sürümle anahtarlanır
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def get_version(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def get_file(self, source: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT file_hash, size, mtime, doc_type, chunk_count, ingested_at FROM files WHERE source = ?",
+                (source,),
+            ).fetchone()
+        if not row:
+            return None
+        keys = ("file_hash", "size", "mtime", "doc_type", "chunk_count", "ingested_at")
+        return dict(zip(keys, row))
+
+    def list_files(self) -> list:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT source, file_hash, size, mtime, doc_type, chunk_count, ingested_at FROM files ORDER BY source"
+            ).fetchall()
+        keys = ("source", "file_hash", "size", "mtime", "doc_type", "chunk_count", "ingested_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def is_current(self, source: str, file_hash: str) -> bool:
+        entry = self.get_file(source)
+        return entry is not None and entry["file_hash"] == file_hash
+
+    def point_ids(self, source: str) -> set:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT point_id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return {r[0] for r in rows}
+
+    def all_point_ids(self) -> dict:
+        # {point_id: source}
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT point_id, source FROM chunks").fetchall())
+
+    def commit_file(self, source: str, file_hash: str, doc_type: str, chunks: list):
+        # chunks: [(point_id, chunk_hash), ...] - kaynağın güncel chunk listesinin tamamı
+        stat = os.stat(source)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (point_id, source, chunk_hash) VALUES (?, ?, ?)",
+                [(pid, source, chash) for pid, chash in chunks],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO files (source, file_hash, size, mtime, doc_type, chunk_count, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source, file_hash, stat.st_size, stat.st_mtime, doc_type, len(chunks), time.time()),
+            )
+            self._bump_version(conn)
+
+    def touch_file(self, source: str):
+        # İçerik aynı ama mtime değişmişse (ör. aynı dosya tekrar kopyalandı) stat bilgisini güncelle
+        stat = os.stat(source)
+        with self._connect() as conn:
+            conn.execute("UPDATE files SET size = ?, mtime = ? WHERE source = ?",
+                         (stat.st_size, stat.st_mtime, source))
+
+    def pending_files(self, paths: list) -> list:
+        # Hash hesaplamadan boyut/mtime ile hızlı kontrol; değişmiş olabilecek dosyaları döner
+        with self._connect() as conn:
+            rows = conn.execute("SELECT source, size, mtime FROM files").fetchall()
+        known = {source: (size, mtime) for source, size, mtime in rows}
+        pending = []
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_size, stat.st_mtime):
+                pending.append(path)
+        return pending
+
+    def forget_file(self, source: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            conn.execute("DELETE FROM files WHERE source = ?", (source,))
+            self._bump_version(conn)
@@ -3,68 +3,260 @@ import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import os
+import glob
+import time
 from uuid import uuid4
 from dotenv import load_dotenv
-from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_qdrant import QdrantVectorStore
-from langchain_community.document_loaders import DirectoryLoader, PyMuPDFLoader
-from PIL import Image
-import pytesseract
+from langchain.docstore.document import Document
+from qdrant_client import models
+from ingest_registry import IngestRegistry, hash_file, hash_text, point_id, source_lock, file_lock
+from ingest_pipeline import iter_pdf_chunks, text_splitter
+from embedding_cache import CachedEmbeddings
+from embedding_providers import build_embeddings, EMBEDDING_PROVIDER, EMBEDDING_TASK_TYPE
+from ingest_writer import IngestWriter
+from vector_store import VectorStoreManager, document_filter, search_params
+from lexical_index import LexicalIndex, HybridRetriever, RETRIEVAL_MODE
+from ocr import get_ocr_executor, ocr_image_file
+from metrics import stage, log, INGEST_LATENCY, INGEST_CHUNKS
 
 load_dotenv()
 
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("❌ GOOGLE_API_KEY .env'de bulunamadı!")
+# EMBEDDING_PROVIDER=google (text-embedding-004) ya da local (ONNX, ağ çağrısı yok)
+embedding_model, EMBEDDING_MODEL, EMBEDDING_DIM = build_embeddings()
 
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="text-embedding-004", 
-    task_type="RETRIEVAL_DOCUMENT",
-    google_api_key=api_key
+embeddings = CachedEmbeddings(
+    embedding_model,
+    model_name=EMBEDDING_MODEL,
+    task_type=EMBEDDING_TASK_TYPE,
 )
 url = "http://qdrant:6333"
 COLLECTION_NAME = "vbo-de-bootcamp"
 
-def ingest_from_docs(upload_dir: str = "/tmp/uploads"):
+registry = IngestRegistry()
+lexical_index = LexicalIndex()
+
+store_manager = VectorStoreManager(url, COLLECTION_NAME, embeddings,
+                                   embedding_model=EMBEDDING_MODEL, embedding_dim=EMBEDDING_DIM)
+
+def get_client():
+    return store_manager.client()
+
+def ensure_collection(dim: int):
+    store_manager.ensure_collection(dim)
+
+def _assign_point_ids(source: str, docs):
+    # docs bir generator olabilir; (point_id, chunk_hash, doc) akışı üretir
+    seen = {}
+    for doc in docs:
+        chunk_hash = hash_text(doc.page_content)
+        page = doc.metadata.get("page", 0)
+        occurrence = seen.get((page, chunk_hash), 0)
+        seen[(page, chunk_hash)] = occurrence + 1
+        doc.metadata["chunk_hash"] = chunk_hash
+        yield point_id(source, page, chunk_hash, occurrence), chunk_hash, doc
+
+def _no_progress(**increments):
+    pass
+
+def _sync_source(source: str, file_hash: str, docs, doc_type: str, progress=_no_progress):
+    # Sadece yeni chunk'lar embed edilir, artık olmayanlar koleksiyondan silinir.
+    # Chunk'lar parse edilirken IngestWriter'a akar ve partiler halinde yazılır.
+    old_ids = registry.point_ids(source)
+    if registry.get_file(source) is None:
+        # İlk kayıt: registry öncesi ingest'lerin rastgele ID'li noktaları aynı source ile duruyorsa
+        # yenilerinin yanında kopya kalmasınlar diye önce silinir
+        client = get_client()
+        if client.collection_exists(COLLECTION_NAME):
+            client.delete(
+                collection_name=COLLECTION_NAME,
+                points_selector=models.FilterSelector(filter=document_filter([source])),
+            )
+    chunks = []
+    lexical_entries = []
+    writer = IngestWriter(get_client(), COLLECTION_NAME, embeddings, ensure_collection, progress=progress)
+    try:
+        for pid, chunk_hash, doc in _assign_point_ids(source, docs):
+            chunks.append((pid, chunk_hash))
+            if pid in old_ids:
+                continue
+            progress(chunks_total=1)
+            writer.add(pid, doc)
+            lexical_entries.append((pid, source, doc.page_content))
+        writer_stats = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    stale_ids = list(old_ids - {pid for pid, _ in chunks})
+    if stale_ids:
+        get_client().delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=models.PointIdsList(points=stale_ids),
+        )
+    registry.commit_file(source, file_hash, doc_type, chunks)
+    # Registry'den sonra: yarıda kalırsa sync_lexical_index eksikleri tamamlar
+    lexical_index.add(lexical_entries)
+    lexical_index.delete(stale_ids)
+    return {"chunks_added": writer_stats["points_upserted"], "chunks_removed": len(stale_ids),
+            "chunks": len(chunks), "writer": writer_stats}
+
+def delete_source(source: str, remove_file: bool = True) -> int:
+    # Kaynağın tüm noktalarını Qdrant'tan, lexical indeksten ve registry'den siler.
+    # Silme source filtresiyle yapılır; registry'ye girmeden yarıda kalmış ingest'lerin noktaları da gider.
+    with source_lock(source):
+        ids = list(registry.point_ids(source))
+        client = get_client()
+        if client.collection_exists(COLLECTION_NAME):
+            client.delete(
+                collection_name=COLLECTION_NAME,
+                points_selector=models.FilterSelector(filter=document_filter([source])),
+            )
+        lexical_index.delete_source(source)
+        if registry.get_file(source) is not None:
+            registry.forget_file(source)
+        if remove_file and os.path.exists(source):
+            os.remove(source)
+    return len(ids)
+
+def optimize_collection():
+    # Silme/değiştirme sonrası çağrılır; aynı anda tek worker tetikler, diğerleri atlar
+    with file_lock("optimize", blocking=False) as acquired:
+        if not acquired or not get_client().collection_exists(COLLECTION_NAME):
+            return None
+        try:
+            with stage("optimize"):
+                status = store_manager.optimize()
+            print(f"🧹 Koleksiyon optimizasyonu tetiklendi: {status}")
+            return status
+        except Exception as e:
+            print(f"⚠️  Koleksiyon optimizasyonu tetiklenemedi: {e}")
+            return None
+
+def list_pdfs(upload_dir: str = "/tmp/uploads"):
+    return sorted(glob.glob(os.path.join(upload_dir, "**/*.pdf"), recursive=True))
+
+def pending_pdfs(upload_dir: str = "/tmp/uploads"):
+    return registry.pending_files(list_pdfs(upload_dir))
+
+def collection_ready():
+    try:
+        client = get_client()
+        if not client.collection_exists(COLLECTION_NAME):
+            return False
+        return client.count(COLLECTION_NAME, exact=False).count > 0
+    except Exception as e:
+        print(f"⚠️  Qdrant koleksiyonu kontrol edilemedi: {e}")
+        return False
+
+def ingest_pdf(path: str, progress=_no_progress):
+    with source_lock(path):
+        return _ingest_pdf(path, progress)
+
+def _ingest_pdf(path: str, progress):
+    file_hash = hash_file(path)
+    if registry.is_current(path, file_hash):
+        registry.touch_file(path)
+        return {"ingested": False, "chunks_added": 0, "chunks_removed": 0}
+    started = time.perf_counter()
+    pages = [0]
+    def counting_progress(**increments):
+        pages[0] += increments.get("pages_parsed", 0)
+        progress(**increments)
+    docs = iter_pdf_chunks(path, progress=counting_progress)
+    synced = _sync_source(path, file_hash, docs, doc_type="pdf", progress=counting_progress)
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    INGEST_LATENCY.labels("pdf").observe(elapsed)
+    INGEST_CHUNKS.labels("pdf").inc(synced["chunks_added"])
+    log(f"📄 {os.path.basename(path)}: +{synced['chunks_added']} / -{synced['chunks_removed']} chunk, "
+        f"{pages[0] / elapsed:.1f} sayfa/s")
+    return {"ingested": True, **synced, "pages": pages[0], "seconds": round(elapsed, 3),
+            "pages_per_s": round(pages[0] / elapsed, 2), "chunks_per_s": round(synced["chunks"] / elapsed, 2)}
+
+def ingest_from_docs(upload_dir: str = "/tmp/uploads", progress=_no_progress):
     try:
         os.makedirs(upload_dir, exist_ok=True)
-        loader = DirectoryLoader(upload_dir, glob="**/*.pdf", loader_cls=PyMuPDFLoader, show_progress=True)
-        raw_documents = loader.load()
-        if not raw_documents:
+        pdf_paths = list_pdfs(upload_dir)
+        if not pdf_paths:
             print(f"⚠️  {upload_dir} dizininde PDF bulunamadı")
             return False
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-        docs = text_splitter.split_documents(raw_documents)
-        QdrantVectorStore.from_documents(docs, embeddings, url=url, collection_name=COLLECTION_NAME)
-        return True
+        started = time.perf_counter()
+        result = {"files_total": len(pdf_paths), "files_ingested": 0, "files_skipped": 0,
+                  "chunks_added": 0, "chunks_removed": 0, "pages": 0, "chunks": 0}
+        for path in pdf_paths:
+            file_result = ingest_pdf(path, progress=progress)
+            if not file_result["ingested"]:
+                result["files_skipped"] += 1
+                continue
+            result["files_ingested"] += 1
+            for key in ("chunks_added", "chunks_removed", "pages", "chunks"):
+                result[key] += file_result[key]
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        result["seconds"] = round(elapsed, 3)
+        result["pages_per_s"] = round(result["pages"] / elapsed, 2)
+        result["chunks_per_s"] = round(result["chunks"] / elapsed, 2)
+        return result
     except Exception as e:
         print(f"❌ Hata: {e}")
         return False
 
-def ingest_from_image(file_path: str):
+def ingest_from_image(file_path: str, progress=_no_progress):
+    # Başarılıysa OCR metnini (zaten indeksliyse ""), hata olursa None döner
     try:
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img)
-        from langchain.docstore.document import Document
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-        docs = text_splitter.split_text(text)
-        docs = [Document(page_content=d) for d in docs]
-        QdrantVectorStore.from_documents(docs, embeddings, url=url, collection_name=COLLECTION_NAME)
-        return True
+        with source_lock(file_path):
+            file_hash = hash_file(file_path)
+            if registry.is_current(file_path, file_hash):
+                return ""
+            started = time.perf_counter()
+            with stage("ocr"):
+                text = get_ocr_executor().submit(ocr_image_file, file_path).result()
+            progress(pages_total=1, pages_parsed=1)
+            docs = text_splitter.split_text(text)
+            docs = [Document(page_content=d, metadata={"source": file_path, "type": "image"}) for d in docs]
+            synced = _sync_source(file_path, file_hash, docs, doc_type="image", progress=progress)
+            INGEST_LATENCY.labels("image").observe(time.perf_counter() - started)
+            INGEST_CHUNKS.labels("image").inc(synced["chunks_added"])
+        return text
     except Exception as e:
-        print(f"❌ Görsel işlenirken hata: {e}")
-        return False
+        log(f"❌ Görsel işlenirken hata: {e}")
+        return None
+
+def sync_lexical_index(batch_size: int = 256):
+    # Lexical indeks sonradan eklendiği için önceden ingest edilmiş noktalar Qdrant'tan doldurulur
+    with file_lock("lexical-sync", blocking=False) as acquired:
+        if not acquired:
+            return 0
+        expected = registry.all_point_ids()
+        indexed = lexical_index.point_ids()
+        lexical_index.delete(list(indexed - set(expected)))
+        missing = [pid for pid in expected if pid not in indexed]
+        if not missing or not collection_ready():
+            return 0
+        print(f"🔤 {len(missing)} chunk lexical indekse ekleniyor...")
+        client = get_client()
+        for start in range(0, len(missing), batch_size):
+            points = client.retrieve(COLLECTION_NAME, ids=missing[start:start + batch_size],
+                                     with_payload=True, with_vectors=False)
+            lexical_index.add([(str(p.id), expected[str(p.id)], (p.payload or {}).get("page_content", ""))
+                               for p in points])
+        return len(missing)
+
+def retrieval_filter(sources: list) -> dict:
+    # Retriever'a invoke sırasında verilen ek argümanlar; sadece seçili dokümanlarda arar
+    if not sources:
+        return {}
+    kwargs = {"filter": document_filter(sources)}
+    if RETRIEVAL_MODE == "hybrid":
+        kwargs["sources"] = list(sources)
+    return kwargs
 
 def get_retriever():
     try:
-        vector_store = QdrantVectorStore.from_existing_collection(
-            collection_name=COLLECTION_NAME,
-            embedding=embeddings,
-            url=url,
-            prefer_grpc=True
+        vector_store = store_manager.vector_store()
+        if RETRIEVAL_MODE == "hybrid":
+            return HybridRetriever(vector_store=vector_store, lexical_index=lexical_index,
+                                   search_params=search_params())
+        bootcamp_retriever = vector_store.as_retriever(
+            search_type="mmr", search_kwargs={"k":3,"fetch_k":10,"search_params":search_params()}
         )
-        bootcamp_retriever = vector_store.as_retriever(search_type="mmr", search_kwargs={"k":3,"fetch_k":10})
         return bootcamp_retriever
     except Exception as e:
         print(f"❌ Retriever oluşturulurken hata: {e}")
@@ -0,0 +1,158 @@
+import os
+import time
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from qdrant_client import models
+from metrics import record_stage
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "256"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "1.0"))
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "30"))
+
+# Tüm ingest işleri aynı havuzu paylaşır; aynı anda en fazla EMBED_CONCURRENCY embedding isteği uçar
+_embed_pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+_upsert_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upsert")
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    text = f"{type(exc).__name__} {exc}".lower()
+    return any(marker in text for marker in ("429", "resourceexhausted", "resource exhausted", "rate limit", "quota"))
+
+
+def is_retryable(exc: Exception) -> bool:
+    text = f"{type(exc).__name__} {exc}".lower()
+    return is_rate_limited(exc) or any(marker in text for marker in ("503", "unavailable", "deadline", "timeout"))
+
+
+def backoff_delay(attempt: int) -> float:
+    # Üstel bekleme + jitter, aynı anda reddedilen istekler aynı anda tekrar denemesin
+    return min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+def _no_progress(**increments):
+    pass
+
+
+class IngestWriter:
+    # Chunk'ları EMBED_BATCH_SIZE'lık partiler halinde paralel embed eder,
+    # sonuçları UPSERT_BATCH_SIZE'lık partiler halinde tek Qdrant client'ı üzerinden yazar.
+    # Bir upsert sürerken sonraki partilerin embedding'i devam eder.
+    def __init__(self, client, collection_name: str, embeddings, ensure_collection, progress=_no_progress):
+        self.client = client
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.ensure_collection = ensure_collection
+        self.progress = progress
+        self._buffer = []
+        self._embedding = deque()
+        self._points = []
+        self._upsert_future = None
+        self._collection_checked = False
+        self.batches = []
+        self.added = 0
+
+    def add(self, pid: str, doc):
+        self._buffer.append((pid, doc))
+        if len(self._buffer) >= EMBED_BATCH_SIZE:
+            self._submit_embed()
+
+    def _submit_embed(self):
+        batch, self._buffer = self._buffer, []
+        while len(self._embedding) >= EMBED_CONCURRENCY:
+            self._collect_embedded()
+        self._embedding.append(_embed_pool.submit(self._embed, batch))
+
+    def _embed(self, batch: list):
+        texts = [doc.page_content for _, doc in batch]
+        started = time.perf_counter()
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                break
+            except Exception as e:
+                if attempt >= EMBED_MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"⏳ Embedding tekrar denenecek ({attempt + 1}/{EMBED_MAX_RETRIES}, {delay:.1f}s): {e}")
+                time.sleep(delay)
+        elapsed = time.perf_counter() - started
+        record_stage("embed_batch", elapsed)
+        stats = {"size": len(batch), "embed_s": round(elapsed, 3), "retries": attempt}
+        return batch, vectors, stats
+
+    def _collect_embedded(self):
+        batch, vectors, stats = self._embedding.popleft().result()
+        if not self._collection_checked:
+            self.ensure_collection(len(vectors[0]))
+            self._collection_checked = True
+        self.batches.append(stats)
+        self.progress(chunks_embedded=len(batch))
+        self._points.extend(
+            models.PointStruct(
+                id=pid,
+                vector=vector,
+                payload={"page_content": doc.page_content, "metadata": doc.metadata},
+            )
+            for (pid, doc), vector in zip(batch, vectors)
+        )
+        if len(self._points) >= UPSERT_BATCH_SIZE:
+            self._submit_upsert()
+
+    def _submit_upsert(self):
+        points, self._points = self._points, []
+        # Sıra korunsun ve bellek sınırlı kalsın diye aynı anda tek upsert
+        self._wait_upsert()
+        self._upsert_future = _upsert_pool.submit(self._upsert, points)
+
+    def _upsert(self, points: list):
+        started = time.perf_counter()
+        self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+        elapsed = time.perf_counter() - started
+        record_stage("qdrant_upsert", elapsed)
+        return len(points), elapsed
+
+    def _wait_upsert(self):
+        if self._upsert_future is None:
+            return
+        count, elapsed = self._upsert_future.result()
+        self._upsert_future = None
+        self.added += count
+        self.progress(points_upserted=count)
+        self.batches.append({"size": count, "upsert_s": round(elapsed, 3)})
+
+    def close(self) -> dict:
+        if self._buffer:
+            self._submit_embed()
+        while self._embedding:
+            self._collect_embedded()
+        if self._points:
+            self._submit_upsert()
+        self._wait_upsert()
+        return self.summary()
+
+    def summary(self) -> dict:
+        embed_times = [b["embed_s"] for b in self.batches if "embed_s" in b]
+        upsert_times = [b["upsert_s"] for b in self.batches if "upsert_s" in b]
+        return {
+            "points_upserted": self.added,
+            "embed_batches": len(embed_times),
+            "embed_batch_avg_s": round(sum(embed_times) / len(embed_times), 3) if embed_times else 0.0,
+            "embed_batch_max_s": max(embed_times, default=0.0),
+            "upsert_batches": len(upsert_times),
+            "upsert_batch_avg_s": round(sum(upsert_times) / len(upsert_times), 3) if upsert_times else 0.0,
+            "upsert_batch_max_s": max(upsert_times, default=0.0),
+            "retries": sum(b.get("retries", 0) for b in self.batches),
+            "batches": self.batches,
+        }
+
+    def abort(self):
+        # Hata durumunda havuzda bekleyen işleri bırak; deterministik ID'ler sayesinde tekrar denemek güvenli
+        for future in self._embedding:
+            future.cancel()
+        self._embedding.clear()
+        if self._upsert_future is not None:
+            self._upsert_future.cancel()
@@ -0,0 +1,163 @@
+import os
+import re
+import sqlite3
+import asyncio
+from functools import partial
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents import Document
+from ingest_registry import STATE_DIR
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(STATE_DIR, "lexical_index.db"))
+# hybrid: BM25 + dense RRF, dense: eski MMR retriever
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Aday sayısı; prompt'a girecek miktarı context_builder'ın token bütçesi sınırlar
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "6"))
+DENSE_K = int(os.getenv("HYBRID_DENSE_K", "10"))
+LEXICAL_K = int(os.getenv("HYBRID_LEXICAL_K", "10"))
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Türkçe ekler için sorgu kelimeleri bu uzunlukta öneklerle aranır (0 = kapalı)
+LEXICAL_PREFIX_LEN = int(os.getenv("LEXICAL_PREFIX_LEN", "5"))
+
+# Formül sembolleri ayrı token olarak indekslenir; "x^2" gibi üslü ifadeler tek token kalır
+MATH_SYMBOLS = "∫∬∮√∑∏∞≤≥≠±∓∂∇→←↔⇒⇔≈≡∈∉⊂⊆∪∩∀∃°′″×÷·"
+_TOKEN_RE = re.compile(rf"[\w^]+|[{MATH_SYMBOLS}]", re.UNICODE)
+
+
+def analyze(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _quote(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+
+def build_match_query(text: str):
+    terms = []
+    for token in dict.fromkeys(analyze(text)):
+        if LEXICAL_PREFIX_LEN and token.isalpha() and len(token) > LEXICAL_PREFIX_LEN:
+            terms.append(_quote(token[:LEXICAL_PREFIX_LEN]) + "*")
+        else:
+            terms.append(_quote(token))
+    return " OR ".join(terms) if terms else None
+
+
+class LexicalIndex:
+    # SQLite FTS5 ters indeksi; sıralama FTS5'in yerleşik bm25() fonksiyonuyla yapılır.
+    # Qdrant point ID'leriyle anahtarlanır, ingest sırasında artımlı güncellenir.
+    def __init__(self, path: str = LEXICAL_INDEX_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                    point_id UNINDEXED, source UNINDEXED, body,
+                    tokenize = "unicode61 remove_diacritics 2 tokenchars '^{MATH_SYMBOLS}'"
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, entries: list):
+        # entries: [(point_id, source, text), ...]
+        if not entries:
+            return
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE point_id = ?", [(pid,) for pid, _, _ in entries])
+            conn.executemany(
+                "INSERT INTO chunks (point_id, source, body) VALUES (?, ?, ?)",
+                [(pid, source, " ".join(analyze(text))) for pid, source, text in entries],
+            )
+
+    def delete(self, point_ids: list):
+        if not point_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE point_id = ?", [(pid,) for pid in point_ids])
+
+    def delete_source(self, source: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+
+    def point_ids(self) -> set:
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT point_id FROM chunks")}
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query: str, k: int = LEXICAL_K, sources: list = None) -> list:
+        # [(point_id, bm25_skoru), ...]; bm25() negatif döner, küçük olan daha alakalı
+        match = build_match_query(query)
+        if not match:
+            return []
+        sql = "SELECT point_id, bm25(chunks) AS score FROM chunks WHERE chunks MATCH ?"
+        params = [match]
+        if sources:
+            sql += f" AND source IN ({', '.join('?' * len(sources))})"
+            params.extend(sources)
+        with self._connect() as conn:
+            return conn.execute(sql + " ORDER BY score LIMIT ?", (*params, k)).fetchall()
+
+
+def reciprocal_rank_fusion(rankings: list, rrf_k: int = RRF_K) -> list:
+    # rankings: her biri ID listesi; dönüş: (id, skor) listesi, en iyi önce
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    # Dense (Qdrant) ve BM25 (FTS5) sonuçlarını reciprocal-rank fusion ile birleştirir
+    vector_store: object
+    lexical_index: object
+    k: int = RETRIEVAL_K
+    dense_k: int = DENSE_K
+    lexical_k: int = LEXICAL_K
+    rrf_k: int = RRF_K
+    search_params: object = None
+
+    def _fetch_points(self, point_ids: list) -> dict:
+        if not point_ids:
+            return {}
+        points = self.vector_store.client.retrieve(
+            self.vector_store.collection_name, ids=point_ids, with_payload=True, with_vectors=False
+        )
+        docs = {}
+        for point in points:
+            payload = point.payload or {}
+            metadata = dict(payload.get(self.vector_store.metadata_payload_key) or {})
+            metadata["_id"] = str(point.id)
+            metadata["_collection_name"] = self.vector_store.collection_name
+            docs[str(point.id)] = Document(
+                page_content=payload.get(self.vector_store.content_payload_key, ""), metadata=metadata
+            )
+        return docs
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None, filter=None, sources=None) -> list:
+        # filter: Qdrant filtresi (dense), sources: aynı kısıtın lexical karşılığı
+        dense_docs = self.vector_store.similarity_search(
+            query, k=self.dense_k, filter=filter, search_params=self.search_params
+        )
+        docs = {str(d.metadata["_id"]): d for d in dense_docs}
+        lexical_ids = [pid for pid, _ in self.lexical_index.search(query, self.lexical_k, sources)]
+        fused = reciprocal_rank_fusion([list(docs), lexical_ids], self.rrf_k)[:self.k]
+        docs.update(self._fetch_points([pid for pid, _ in fused if pid not in docs]))
+        results = []
+        for pid, score in fused:
+            doc = docs.get(pid)
+            # Silinmiş ama indekste kalmış noktalar atlanır
+            if doc is not None:
+                doc.metadata["rrf_score"] = round(score, 6)
+                results.append(doc)
+        return results
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None, **kwargs) -> list:
+        # Varsayılan async sürüm filtre argümanlarını iletmez; sync sürüm loop'un executor'unda çalışır
+        return await asyncio.get_running_loop().run_in_executor(
+            None, partial(self._get_relevant_documents, query, **kwargs)
+        )
@@ -0,0 +1,216 @@
+import os
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from ingest_writer import is_rate_limited
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Slot için en fazla bu kadar beklenir, sonra 503 döner
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "1.0"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "20"))
+LLM_RETRY_AFTER = int(os.getenv("LLM_RETRY_AFTER", "5"))
+
+
+class LLMSaturated(Exception):
+    def __init__(self, message: str, retry_after: int = LLM_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_delay(attempt: int) -> float:
+    return min(LLM_RETRY_MAX, LLM_RETRY_BASE * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+class _StreamFeed:
+    # Tek bir akışın parçaları; sonradan katılan abone de baştan itibaren okur
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.changed = asyncio.Condition()
+
+    async def push(self, item):
+        async with self.changed:
+            self.items.append(item)
+            self.changed.notify_all()
+
+    async def finish(self, error=None):
+        async with self.changed:
+            self.done = True
+            self.error = error
+            self.changed.notify_all()
+
+
+class LLMGovernor:
+    # Paylaşılan llm önündeki kapı: aynı anda en fazla max_concurrency çağrı,
+    # sınırlı bekleme kuyruğu, 429'larda jitter'lı tekrar deneme ve aynı isteklerin birleştirilmesi
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 max_queue: int = LLM_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._semaphore = None
+        self._inflight = {}
+        self._streams = {}
+        self.waiting = 0
+        self.active = 0
+        self.stats = {"calls": 0, "coalesced": 0, "rejected": 0, "retried": 0, "rate_limited": 0}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def acquire(self, timeout=...):
+        timeout = self.queue_timeout if timeout is ... else timeout
+        if self.waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise LLMSaturated("LLM kuyruğu dolu")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise LLMSaturated(f"LLM slotu {timeout:g}s içinde boşalmadı")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self, timeout=...):
+        await self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def _call_with_retry(self, coro_factory, timeout):
+        for attempt in range(LLM_RETRY_ATTEMPTS + 1):
+            try:
+                async with self.slot(timeout):
+                    self.stats["calls"] += 1
+                    return await coro_factory()
+            except LLMSaturated:
+                raise
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                self.stats["rate_limited"] += 1
+                if attempt >= LLM_RETRY_ATTEMPTS:
+                    raise LLMSaturated(f"Gemini hız sınırı: {e}")
+            # Bekleme slot dışında; bu sırada başka istekler çalışabilir
+            self.stats["retried"] += 1
+            await asyncio.sleep(_retry_delay(attempt))
+
+    async def run(self, coro_factory, key=None, timeout=...):
+        # key verilirse aynı anahtarla süren çağrının sonucu paylaşılır (singleflight).
+        # Dönüş: (sonuç, birleştirildi_mi)
+        if key is not None and key in self._inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._inflight[key]), True
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._inflight[key] = future
+        try:
+            result = await self._call_with_retry(coro_factory, timeout)
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Bekleyen yoksa "exception was never retrieved" uyarısını engelle
+            future.exception()
+            raise
+        finally:
+            if key is not None:
+                self._inflight.pop(key, None)
+
+    async def open_stream(self, stream_factory, key=None, committed=None, timeout=...):
+        # Akışlı çağrı. stream_factory() bir async iterator döndürür; parçalar ayrı bir görevde üretilir ve
+        # tüm abonelere dağıtılır. key verilirse aynı anahtarla süren akışa abone olunur (singleflight).
+        # committed(parça) True olana kadar (ör. ilk token) gelen 429'larda jitter'lı tekrar denenir.
+        # Slot burada alınır ki doygunlukta istemci akış başlamadan LLMSaturated (503) alsın.
+        # Dönüş: (parça iterator'ı, birleştirildi_mi)
+        if key is not None and key in self._streams:
+            self.stats["coalesced"] += 1
+            return self._subscribe(self._streams[key]), True
+        timeout = self.queue_timeout if timeout is ... else timeout
+        await self.acquire(timeout)
+        feed = _StreamFeed()
+        if key is not None:
+            self._streams[key] = feed
+        feed.task = asyncio.create_task(self._produce(feed, stream_factory, key, committed, timeout))
+        return self._subscribe(feed), False
+
+    async def _produce(self, feed, stream_factory, key, committed, timeout):
+        holding = True
+        try:
+            for attempt in range(LLM_RETRY_ATTEMPTS + 1):
+                if not holding:
+                    await self.acquire(timeout)
+                    holding = True
+                self.stats["calls"] += 1
+                started = False
+                try:
+                    async for item in stream_factory():
+                        started = started or committed is None or committed(item)
+                        await feed.push(item)
+                    break
+                except Exception as e:
+                    if started or not is_rate_limited(e):
+                        raise
+                    self.stats["rate_limited"] += 1
+                    if attempt >= LLM_RETRY_ATTEMPTS:
+                        raise LLMSaturated(f"Gemini hız sınırı: {e}")
+                self.release()
+                holding = False
+                self.stats["retried"] += 1
+                await asyncio.sleep(_retry_delay(attempt))
+            await feed.finish()
+        except BaseException as e:
+            await feed.finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            if holding:
+                self.release()
+            if key is not None and self._streams.get(key) is feed:
+                del self._streams[key]
+
+    async def _subscribe(self, feed):
+        feed.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with feed.changed:
+                    await feed.changed.wait_for(lambda: len(feed.items) > position or feed.done)
+                    batch = feed.items[position:]
+                    finished = feed.done
+                for item in batch:
+                    yield item
+                position += len(batch)
+                if finished and position >= len(feed.items):
+                    break
+            if feed.error is not None:
+                raise feed.error
+        finally:
+            feed.subscribers -= 1
+            # İstemcilerin hepsi koptuysa üretim durdurulur
+            if feed.subscribers == 0 and not feed.task.done():
+                feed.task.cancel()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "active": self.active, "waiting": self.waiting,
+                "max_concurrency": self.max_concurrency}
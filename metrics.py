@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import contextvars
+from contextlib import contextmanager
+from uuid import uuid4
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import (Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest,
+                               CONTENT_TYPE_LATEST, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+# WEB_CONCURRENCY > 1 iken her worker metriklerini bu dizine yazar, /metrics hepsini toplar
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+REQUEST_ID_HEADER = "X-Request-ID"
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+INGEST_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+REQUEST_LATENCY = Histogram("rag_http_request_duration_seconds", "HTTP isteği süresi (yanıt gövdesi dahil)",
+                            ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram("rag_stage_duration_seconds", "İstek/ingest aşaması süresi",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("rag_llm_tokens", "LLM token sayısı", ["kind"])
+CONTEXT_TOKENS = Histogram("rag_context_tokens", "Prompt'a giren bağlamın yaklaşık token sayısı",
+                           buckets=(100, 200, 400, 800, 1200, 1600, 2400, 3200, 4800))
+CHUNKS = Histogram("rag_chunks", "Soru başına chunk sayısı (retrieved: retriever çıktısı, packed: prompt'a giren)",
+                   ["stage"], buckets=(0, 1, 2, 4, 6, 8, 10, 15, 20, 30))
+CACHE_EVENTS = Counter("rag_cache_events", "Cache isabetleri", ["cache", "result"])
+INGEST_LATENCY = Histogram("rag_ingest_duration_seconds", "Dosya ingest süresi", ["kind"], buckets=INGEST_BUCKETS)
+INGEST_CHUNKS = Counter("rag_ingest_chunks", "Ingest edilen chunk sayısı", ["kind"])
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+# İstek boyunca ölçülen aşamalar; to_thread ve LangChain thread'leri context'i kopyaladığı için aynı liste paylaşılır
+trace_var = contextvars.ContextVar("trace", default=None)
+
+
+def new_request_id(incoming: str = None) -> str:
+    if incoming and _REQUEST_ID_RE.match(incoming):
+        return incoming
+    return uuid4().hex[:16]
+
+
+def log(message: str):
+    request_id = request_id_var.get()
+    print(f"[{request_id}] {message}" if request_id else message)
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_LATENCY.labels(name).observe(seconds)
+    trace = trace_var.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def cache_event(cache: str, hit: bool, count: int = 1):
+    if count:
+        CACHE_EVENTS.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+def record_usage(usage: dict, retrieved: int = None):
+    LLM_TOKENS.labels("prompt").inc(usage.get("prompt_tokens") or 0)
+    LLM_TOKENS.labels("output").inc(usage.get("output_tokens") or 0)
+    CONTEXT_TOKENS.observe(usage.get("context_tokens") or 0)
+    CHUNKS.labels("packed").observe(usage.get("context_chunks") or 0)
+    if retrieved is not None:
+        CHUNKS.labels("retrieved").observe(retrieved)
+
+
+def format_trace(trace: list) -> str:
+    return ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in trace)
+
+
+class StageTimer(BaseCallbackHandler):
+    # qa_chain içindeki adlandırılmış adımların süreleri: yeniden yazma, arama, paketleme, üretim
+    CHAIN_STAGES = {
+        "reformulate": "reformulate",
+        "pack_documents": "pack_context",
+        "stuff_documents_chain": "generate",
+    }
+    run_inline = True
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.started = {}
+        self.retrieved = 0
+        self.generating = False
+        self.first_token_seen = False
+
+    def _begin(self, run_id, stage_name: str):
+        self.started[run_id] = (stage_name, time.perf_counter())
+
+    def _end(self, run_id):
+        entry = self.started.pop(run_id, None)
+        if entry is not None:
+            record_stage(entry[0], time.perf_counter() - entry[1])
+        return entry
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        stage_name = self.CHAIN_STAGES.get(kwargs.get("name"))
+        if stage_name is not None:
+            self._begin(run_id, stage_name)
+            self.generating = self.generating or stage_name == "generate"
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        entry = self._end(run_id)
+        if entry is not None and entry[0] == "generate":
+            self.generating = False
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.started.pop(run_id, None)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._begin(run_id, "retrieve")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+        self.retrieved += len(documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self.started.pop(run_id, None)
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.generating and not self.first_token_seen:
+            self.first_token_seen = True
+            record_stage("first_token", time.perf_counter() - self.created)
+
+
+class StatsCollector:
+    # Modüllerin kendi sayaçları (get_stats/stats()) scrape anında okunur
+    def __init__(self, sources: dict):
+        self.sources = sources
+
+    def collect(self):
+        family = GaugeMetricFamily("rag_component_stat", "Bileşen sayaçları ve durumları", labels=["component", "stat"])
+        for component, read in self.sources.items():
+            try:
+                values = read()
+            except Exception:
+                continue
+            for name, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    family.add_metric([component, name], value)
+        yield family
+
+
+def register_stats(sources: dict):
+    # Çoklu process modunda süreç içi sayaçlar toplanamaz; sadece tek worker'da eklenir
+    if not PROMETHEUS_MULTIPROC_DIR:
+        REGISTRY.register(StatsCollector(sources))
+
+
+def render_metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
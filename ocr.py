@@ -0,0 +1,134 @@
+import os
+import io
+import time
+import sqlite3
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+import pytesseract
+from ingest_registry import STATE_DIR
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_LANG = os.getenv("OCR_LANG", "tur+eng")
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", os.path.join(STATE_DIR, "ocr_cache.db"))
+# Tesseract için hedef çözünürlük: uzun kenar bu aralığa getirilir
+OCR_MIN_SIDE = int(os.getenv("OCR_MIN_SIDE", "1200"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2500"))
+# Eğiklik bu açı aralığında (derece) aranır
+OCR_DESKEW_MAX_ANGLE = float(os.getenv("OCR_DESKEW_MAX_ANGLE", "5"))
+OCR_DESKEW_STEP = float(os.getenv("OCR_DESKEW_STEP", "0.5"))
+# Taranmış PDF sayfaları bu DPI ile render edilir; bundan az metni olan sayfa görsel kabul edilir
+OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "200"))
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+OCR_PREPROCESS_VERSION = "1"
+
+_executor = None
+
+
+def get_ocr_executor():
+    # Tesseract ve ön işleme CPU yoğun; GIL'e takılmasın diye ayrı process'lerde çalışır
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def _connect():
+    os.makedirs(os.path.dirname(OCR_CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(OCR_CACHE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)")
+    return conn
+
+
+def _cache_key(content_hash: str) -> str:
+    return hashlib.sha256(f"{content_hash}|{OCR_LANG}|{OCR_PREPROCESS_VERSION}".encode()).hexdigest()
+
+
+def cache_get(content_hash: str):
+    with _connect() as conn:
+        row = conn.execute("SELECT text FROM ocr WHERE key = ?", (_cache_key(content_hash),)).fetchone()
+    return row[0] if row else None
+
+
+def cache_put(content_hash: str, text: str):
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO ocr (key, text, created_at) VALUES (?, ?, ?)",
+                     (_cache_key(content_hash), text, time.time()))
+
+
+def _resize(img: Image.Image) -> Image.Image:
+    longest = max(img.size)
+    if longest < OCR_MIN_SIDE:
+        scale = OCR_MIN_SIDE / longest
+    elif longest > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / longest
+    else:
+        return img
+    return img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+
+
+def estimate_skew(gray: Image.Image) -> float:
+    # Projeksiyon profili: metin satırları yataya oturduğunda satır toplamlarının varyansı en yüksektir
+    small = gray.copy()
+    small.thumbnail((800, 800))
+    ink = Image.fromarray(((np.asarray(small) < np.asarray(small).mean() - 10) * 255).astype(np.uint8))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-OCR_DESKEW_MAX_ANGLE, OCR_DESKEW_MAX_ANGLE + 1e-9, OCR_DESKEW_STEP):
+        rows = np.asarray(ink.rotate(angle, resample=Image.NEAREST, expand=True)).sum(axis=1, dtype=np.float64)
+        score = float(np.var(rows))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess(img: Image.Image) -> Image.Image:
+    # Gri tonlama, çözünürlük normalizasyonu, eğiklik düzeltme ve kontrast
+    gray = ImageOps.exif_transpose(img).convert("L")
+    gray = _resize(gray)
+    angle = estimate_skew(gray)
+    if abs(angle) >= OCR_DESKEW_STEP:
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return ImageOps.autocontrast(gray, cutoff=1)
+
+
+def ocr_image(img: Image.Image, content_hash: str = None) -> str:
+    if content_hash:
+        cached = cache_get(content_hash)
+        if cached is not None:
+            return cached
+    text = pytesseract.image_to_string(preprocess(img), lang=OCR_LANG)
+    if content_hash:
+        cache_put(content_hash, text)
+    return text
+
+
+def ocr_image_file(path: str) -> str:
+    # Process pool'da çalışır
+    with open(path, "rb") as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        return ocr_image(img, hashlib.sha256(data).hexdigest())
+
+
+def needs_ocr(page) -> bool:
+    # Metin katmanı yok ya da çok az, ama sayfada görsel var: taranmış sayfa
+    return len(page.get_text().strip()) < OCR_MIN_TEXT_CHARS and bool(page.get_images(full=False))
+
+
+def ocr_pdf_page(page) -> str:
+    # Parse worker process'inde çağrılır; cache anahtarı render edilmiş piksellerin hash'i
+    pixmap = page.get_pixmap(dpi=OCR_PDF_DPI, colorspace="gray")
+    content_hash = hashlib.sha256(pixmap.samples).hexdigest()
+    cached = cache_get(content_hash)
+    if cached is not None:
+        return cached
+    img = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    text = pytesseract.image_to_string(preprocess(img), lang=OCR_LANG)
+    cache_put(content_hash, text)
+    return text
@@ -0,0 +1,118 @@
+import os
+import re
+import asyncio
+import threading
+from collections import Counter
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+# always: her takip sorusunu yeniden yaz, auto: sadece bağlama dayanıyorsa, never: hiç yazma
+REFORMULATE_MODE = os.getenv("REFORMULATE_MODE", "auto")
+# Yeniden yazma sürerken ham soruyla retrieval'ı paralel başlat
+REFORMULATE_SPECULATIVE = os.getenv("REFORMULATE_SPECULATIVE", "false").lower() == "true"
+# Spekülatif modda yeniden yazma bu süreyi aşarsa ham sorunun sonuçları kullanılır (0 = bekle)
+REFORMULATE_DEADLINE = float(os.getenv("REFORMULATE_DEADLINE", "0"))
+FOLLOWUP_MAX_WORDS = int(os.getenv("FOLLOWUP_MAX_WORDS", "4"))
+
+# Önceki mesaja gönderme yapan kelimeler (Türkçe + İngilizce)
+FOLLOWUP_MARKERS = {
+    "bu", "bunu", "bunun", "buna", "bunda", "bundan", "bunlar", "bunları",
+    "şu", "şunu", "şunun", "şuna", "o", "onu", "onun", "ona", "onda", "ondan", "onlar", "onları",
+    "önceki", "yukarıdaki", "yukarıda", "aynı", "aynısı", "peki", "devam", "ayrıca", "başka",
+    "yine", "tekrar", "diğer", "diğerleri", "sonraki", "öbür", "örnek", "örnekle",
+    "it", "its", "this", "that", "these", "those", "they", "them", "above", "previous",
+    "again", "also", "another", "same", "continue", "more", "else",
+}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(path: str):
+    with _stats_lock:
+        stats[path] += 1
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(stats)
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def followup_reason(question: str):
+    # Soru önceki mesajlara dayanıyorsa nedenini, bağımsızsa None döner
+    words = _WORD_RE.findall(question.lower())
+    if len(words) <= FOLLOWUP_MAX_WORDS:
+        return "short_followup"
+    if any(word in FOLLOWUP_MARKERS for word in words):
+        return "references_history"
+    return None
+
+
+def is_standalone(question: str, chat_history) -> bool:
+    return not chat_history or followup_reason(question) is None
+
+
+def needs_reformulation(question: str, chat_history) -> tuple:
+    if not chat_history:
+        return False, "no_history"
+    if REFORMULATE_MODE == "never":
+        return False, "disabled"
+    if REFORMULATE_MODE == "always":
+        return True, "forced"
+    reason = followup_reason(question)
+    if reason:
+        return True, reason
+    return False, "self_contained"
+
+
+def build_retrieval_runnable(llm, retriever, contextualize_q_prompt):
+    # create_history_aware_retriever yerine: yeniden yazma LLM çağrısı sadece gerektiğinde yapılır
+    rewrite_chain = (contextualize_q_prompt | llm | StrOutputParser()).with_config(run_name="reformulate")
+
+    # inputs["search_kwargs"] (ör. doküman filtresi) retriever'a aynen iletilir
+    def retrieve(inputs: dict, config):
+        question = inputs["input"]
+        search_kwargs = inputs.get("search_kwargs") or {}
+        rewrite, reason = needs_reformulation(question, inputs.get("chat_history"))
+        _count(reason)
+        if not rewrite:
+            return retriever.invoke(question, config, **search_kwargs)
+        _count("rewrite")
+        rewritten = rewrite_chain.invoke(inputs, config)
+        return retriever.invoke(rewritten, config, **search_kwargs)
+
+    async def aretrieve(inputs: dict, config):
+        question = inputs["input"]
+        search_kwargs = inputs.get("search_kwargs") or {}
+        rewrite, reason = needs_reformulation(question, inputs.get("chat_history"))
+        _count(reason)
+        if not rewrite:
+            return await retriever.ainvoke(question, config, **search_kwargs)
+        _count("rewrite")
+        if not REFORMULATE_SPECULATIVE:
+            rewritten = await rewrite_chain.ainvoke(inputs, config)
+            return await retriever.ainvoke(rewritten, config, **search_kwargs)
+
+        speculative = asyncio.create_task(retriever.ainvoke(question, config, **search_kwargs))
+        try:
+            if REFORMULATE_DEADLINE > 0:
+                rewritten = await asyncio.wait_for(rewrite_chain.ainvoke(inputs, config), REFORMULATE_DEADLINE)
+            else:
+                rewritten = await rewrite_chain.ainvoke(inputs, config)
+        except asyncio.TimeoutError:
+            _count("speculative_timeout")
+            return await speculative
+        if normalize_question(rewritten) == normalize_question(question):
+            _count("speculative_hit")
+            return await speculative
+        _count("speculative_miss")
+        speculative.cancel()
+        return await retriever.ainvoke(rewritten, config, **search_kwargs)
+
+    return RunnableLambda(retrieve, afunc=aretrieve).with_config(run_name="chat_retriever_chain")
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import messages_from_dict, message_to_dict
+from ingest_registry import STATE_DIR
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(STATE_DIR, "sessions.db"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+# chat_history'ye giren mesajların yaklaşık token üst sınırı
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# Oturum başına diskte tutulan en fazla mesaj
+HISTORY_MAX_STORED = int(os.getenv("HISTORY_MAX_STORED", "200"))
+EVICTION_INTERVAL = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    # Gemini tokenizer'ına istek atmadan kaba tahmin (~4 karakter / token)
+    return len(text) // 4 + 1
+
+
+def split_turns(messages: list) -> list:
+    # Her tur bir insan mesajı ve ardından gelen cevaplardan oluşur
+    turns = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def truncate_turn(turn: list, token_budget: int) -> list:
+    limit = max(1, token_budget // len(turn)) * 4
+    return [m.model_copy(update={"content": m.content[:limit]}) if isinstance(m.content, str) else m
+            for m in turn]
+
+
+def window_messages(messages: list, token_budget: int = HISTORY_TOKEN_BUDGET) -> list:
+    # En yeni turlardan geriye doğru bütçe dolana kadar al; son tur bütçeyi aşıyorsa kırpılarak tutulur
+    window, used = [], 0
+    for turn in reversed(split_turns(messages)):
+        cost = sum(estimate_tokens(str(m.content)) for m in turn)
+        if used + cost > token_budget:
+            if not window:
+                window.append(truncate_turn(turn, token_budget))
+            break
+        window.append(turn)
+        used += cost
+    return [m for turn in reversed(window) for m in turn]
+
+
+class SessionStore:
+    def __init__(self, path: str = SESSION_DB_PATH, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._last_eviction = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    last_active REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions(last_active);
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    message TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_messages(self, session_id: str) -> list:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+            conn.execute("UPDATE sessions SET last_active = ? WHERE session_id = ?", (time.time(), session_id))
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def add_messages(self, session_id: str, messages: list):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, created_at, last_active) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_active = excluded.last_active",
+                (session_id, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO messages (session_id, message) VALUES (?, ?)",
+                [(session_id, json.dumps(message_to_dict(m), ensure_ascii=False)) for m in messages],
+            )
+            # Pencerenin çok ötesindeki eski mesajlar diskte de tutulmaz
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, HISTORY_MAX_STORED),
+            )
+        self.maybe_evict()
+
+    def clear(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def maybe_evict(self):
+        with self._lock:
+            if time.time() - self._last_eviction < EVICTION_INTERVAL:
+                return
+            self._last_eviction = time.time()
+        self.evict()
+
+    def evict(self):
+        # TTL'i geçen boşta oturumlar ve SESSION_MAX üzerindeki en eski (LRU) oturumlar silinir
+        cutoff = time.time() - self.ttl
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM sessions WHERE last_active < ? OR session_id NOT IN "
+                "(SELECT session_id FROM sessions ORDER BY last_active DESC LIMIT ?)",
+                (cutoff, self.max_sessions),
+            )
+            conn.execute("DELETE FROM messages WHERE session_id NOT IN (SELECT session_id FROM sessions)")
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    # RunnableWithMessageHistory için: mesajlar SQLite'ta, chat_history token bütçesine göre pencerelenir
+    def __init__(self, store: SessionStore, session_id: str, token_budget: int = HISTORY_TOKEN_BUDGET):
+        self.store = store
+        self.session_id = session_id
+        self.token_budget = token_budget
+
+    @property
+    def messages(self) -> list:
+        return window_messages(self.store.get_messages(self.session_id), self.token_budget)
+
+    def add_messages(self, messages: list) -> None:
+        self.store.add_messages(self.session_id, list(messages))
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
@@ -0,0 +1,102 @@
+import os
+import re
+import glob
+import time
+import hashlib
+from uuid import uuid4
+from PIL import Image, ImageOps
+
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(100 * 1024 * 1024)))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# OCR ve vision çağrısından önce görselin uzun kenarı bu boyuta indirilir
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Multipart sınırları ve form alanları için Content-Length payı
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Dosya adları "<içerik hash'inin ilk 16 hanesi>_<orijinal ad>" şeklinde saklanır
+HASH_PREFIX_LEN = 16
+_HASH_PREFIX_RE = re.compile(rf"^[0-9a-f]{{{HASH_PREFIX_LEN}}}_")
+_UNSAFE_CHARS_RE = re.compile(r"[^\w.\-]+", re.UNICODE)
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int):
+        size = f"{limit // (1024 * 1024)} MB" if limit >= 1024 * 1024 else f"{limit // 1024} KB"
+        super().__init__(f"Dosya {size} sınırını aşıyor")
+        self.limit = limit
+
+
+def safe_filename(filename: str) -> str:
+    name = _UNSAFE_CHARS_RE.sub("_", os.path.basename(filename or "")).strip("._")
+    return name[-100:] or "upload"
+
+
+def hashed_name(file_hash: str, filename: str) -> str:
+    return f"{file_hash[:HASH_PREFIX_LEN]}_{safe_filename(filename)}"
+
+
+def display_name(path: str) -> str:
+    return _HASH_PREFIX_RE.sub("", os.path.basename(path))
+
+
+def copy_upload(src, upload_dir: str, max_bytes: int) -> tuple:
+    # Multipart parser'ın geçici dosyasından parça parça kopyalar; tüm dosya hiçbir zaman bellekte tutulmaz.
+    # Dönüş: (geçici yol, sha256, boyut). Sınır aşılırsa kısmi dosya silinir.
+    incoming = os.path.join(upload_dir, ".incoming")
+    os.makedirs(incoming, exist_ok=True)
+    part_path = os.path.join(incoming, f"{uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(part_path, "wb") as dst:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                dst.write(chunk)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return part_path, digest.hexdigest(), size
+
+
+def cleanup_incoming(upload_dir: str, max_age: float = 3600) -> int:
+    # Yarıda kalmış yüklemelerin geçici dosyaları
+    removed = 0
+    for path in glob.glob(os.path.join(upload_dir, ".incoming", "*.part")):
+        if time.time() - os.path.getmtime(path) > max_age:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def finalize_upload(part_path: str, upload_dir: str, file_hash: str, filename: str) -> str:
+    # Aynı içerik aynı ada gider; aynı adlı farklı içerikler birbirinin üzerine yazmaz
+    final_path = os.path.join(upload_dir, hashed_name(file_hash, filename))
+    os.replace(part_path, final_path)
+    return final_path
+
+
+def normalize_image(part_path: str, upload_dir: str, file_hash: str, filename: str) -> str:
+    # EXIF yönü uygulanır, uzun kenar IMAGE_MAX_SIDE'a indirilir ve JPEG olarak yeniden kodlanır
+    stem = os.path.splitext(safe_filename(filename))[0]
+    final_path = os.path.join(upload_dir, hashed_name(file_hash, f"{stem}.jpg"))
+    try:
+        with Image.open(part_path) as img:
+            # JPEG'lerde çözme sırasında küçültme: büyük fotoğraflar tam çözünürlükte açılmaz
+            img.draft("RGB", (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+            img.save(final_path, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return final_path
+
@@ -0,0 +1,223 @@
+import os
+import time
+import threading
+from qdrant_client import QdrantClient, models
+from langchain_qdrant import QdrantVectorStore
+
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))
+QDRANT_HEALTH_CHECK_INTERVAL = float(os.getenv("QDRANT_HEALTH_CHECK_INTERVAL", "30"))
+
+# Koleksiyon şeması: HNSW, opsiyonel int8 quantization ve payload index'leri burada tanımlıdır
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "64"))
+# none | int8
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none").lower()
+QDRANT_QUANTIZATION_OVERSAMPLING = float(os.getenv("QDRANT_QUANTIZATION_OVERSAMPLING", "2.0"))
+# Orijinal vektörler diskte, int8 kopyaları RAM'de tutulabilir
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "false").lower() == "true"
+# Silinmiş nokta oranı bu eşiği aşan segmentler optimizer tarafından yeniden yazılır (vacuum)
+QDRANT_VACUUM_DELETED_THRESHOLD = float(os.getenv("QDRANT_VACUUM_DELETED_THRESHOLD", "0.1"))
+QDRANT_VACUUM_MIN_VECTORS = int(os.getenv("QDRANT_VACUUM_MIN_VECTORS", "100"))
+
+PAYLOAD_INDEXES = {
+    "metadata.source": models.PayloadSchemaType.KEYWORD,
+    "metadata.page": models.PayloadSchemaType.INTEGER,
+    "metadata.type": models.PayloadSchemaType.KEYWORD,
+}
+
+
+class EmbeddingMismatch(Exception):
+    pass
+
+
+def hnsw_config() -> models.HnswConfigDiff:
+    return models.HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT)
+
+
+def quantization_config():
+    if QDRANT_QUANTIZATION != "int8":
+        return None
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
+
+def search_params() -> models.SearchParams:
+    # int8 kullanılıyorsa adaylar fazladan çekilip orijinal vektörlerle yeniden puanlanır
+    quantization = None
+    if quantization_config() is not None:
+        quantization = models.QuantizationSearchParams(rescore=True, oversampling=QDRANT_QUANTIZATION_OVERSAMPLING)
+    return models.SearchParams(hnsw_ef=QDRANT_HNSW_EF, quantization=quantization)
+
+
+def document_filter(sources: list):
+    if not sources:
+        return None
+    return models.Filter(must=[
+        models.FieldCondition(key="metadata.source", match=models.MatchAny(any=list(sources)))
+    ])
+
+
+class VectorStoreManager:
+    # Süreç genelinde tek Qdrant client'ı ve tek QdrantVectorStore; ingest ve retrieval aynı bağlantıyı kullanır
+    def __init__(self, url: str, collection_name: str, embeddings, prefer_grpc: bool = QDRANT_PREFER_GRPC,
+                 embedding_model: str = None, embedding_dim: int = None):
+        self.url = url
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.embedding_dim = embedding_dim
+        self.prefer_grpc = prefer_grpc
+        self._client = None
+        self._store = None
+        self._lock = threading.Lock()
+        self.healthy = None
+        self._checker = None
+        self._schema_ready = False
+        self._embeddings_verified = False
+
+    def _new_client(self):
+        return QdrantClient(url=self.url, prefer_grpc=self.prefer_grpc, timeout=QDRANT_TIMEOUT)
+
+    def client(self) -> QdrantClient:
+        with self._lock:
+            if self._client is None:
+                self._client = self._new_client()
+            return self._client
+
+    def vector_store(self) -> QdrantVectorStore:
+        # Koleksiyon yoksa QdrantVectorStore hata verir; çağıran taraf yakalar
+        with self._lock:
+            if self._client is None:
+                self._client = self._new_client()
+            if self._store is None:
+                self._store = QdrantVectorStore(
+                    client=self._client,
+                    collection_name=self.collection_name,
+                    embedding=self.embeddings,
+                )
+            return self._store
+
+    def reconnect(self):
+        with self._lock:
+            old = self._client
+            self._client = self._new_client()
+            if self._store is not None:
+                # Retriever'lar aynı store nesnesini tuttuğu için client'ı yerinde değiştir
+                self._store._client = self._client
+        if old is not None:
+            try:
+                old.close()
+            except Exception:
+                pass
+        print("🔌 Qdrant bağlantısı yenilendi")
+
+    def reset_store(self):
+        # Koleksiyon silinip yeniden oluşturulduğunda store tekrar doğrulanmalı
+        with self._lock:
+            self._store = None
+            self._schema_ready = False
+            self._embeddings_verified = False
+
+    def ensure_collection(self, dim: int):
+        client = self.client()
+        if not client.collection_exists(self.collection_name):
+            client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=QDRANT_ON_DISK),
+                hnsw_config=hnsw_config(),
+                quantization_config=quantization_config(),
+                metadata={"embedding_model": self.embedding_model, "embedding_dim": dim},
+            )
+            print(f"🗂️  Koleksiyon oluşturuldu: {self.collection_name} (dim={dim}, quantization={QDRANT_QUANTIZATION})")
+            self.reset_store()
+        self.verify_embeddings(dim)
+        self.ensure_schema()
+
+    def verify_embeddings(self, dim: int = None):
+        # Koleksiyonu dolduran model ile şu anki embedding modeli aynı olmalı; farklı boyut ya da
+        # farklı modelin vektörleri aynı uzayda değildir ve arama sessizce bozulur
+        if self._embeddings_verified:
+            return
+        dim = dim or self.embedding_dim
+        client = self.client()
+        info = client.get_collection(self.collection_name)
+        size = info.config.params.vectors.size
+        metadata = info.config.metadata or {}
+        if dim and size != dim:
+            raise EmbeddingMismatch(
+                f"Koleksiyon {size} boyutlu ({metadata.get('embedding_model', 'bilinmeyen model')}), "
+                f"embedding modeli {self.embedding_model} {dim} boyutlu; koleksiyonu yeniden oluşturun"
+            )
+        recorded = metadata.get("embedding_model")
+        if recorded and self.embedding_model and recorded != self.embedding_model:
+            raise EmbeddingMismatch(
+                f"Koleksiyon {recorded} ile oluşturulmuş, şu anki embedding modeli {self.embedding_model}"
+            )
+        if not recorded and self.embedding_model:
+            # Eski koleksiyon: modeli kaydet ki sonraki değişiklikler yakalansın
+            client.update_collection(self.collection_name,
+                                     metadata={"embedding_model": self.embedding_model, "embedding_dim": size})
+            print(f"🏷️  Koleksiyona embedding modeli kaydedildi: {self.embedding_model} (dim={size})")
+        self._embeddings_verified = True
+
+    def ensure_schema(self):
+        # Mevcut koleksiyonu config'e getirir: eksik payload index'leri, HNSW ve quantization ayarları
+        if self._schema_ready:
+            return
+        client = self.client()
+        info = client.get_collection(self.collection_name)
+        existing = info.payload_schema or {}
+        for field, schema in PAYLOAD_INDEXES.items():
+            if field not in existing:
+                client.create_payload_index(self.collection_name, field_name=field, field_schema=schema, wait=True)
+        updates = {}
+        current_hnsw = info.config.hnsw_config
+        if (current_hnsw.m, current_hnsw.ef_construct) != (QDRANT_HNSW_M, QDRANT_HNSW_EF_CONSTRUCT):
+            updates["hnsw_config"] = hnsw_config()
+        desired = quantization_config()
+        if desired is not None and info.config.quantization_config is None:
+            updates["quantization_config"] = desired
+        elif desired is None and info.config.quantization_config is not None:
+            updates["quantization_config"] = models.Disabled.DISABLED
+        if updates:
+            client.update_collection(self.collection_name, **updates)
+            print(f"🛠️  Koleksiyon ayarları güncellendi: {', '.join(updates)}")
+        self._schema_ready = True
+
+    def optimize(self) -> dict:
+        # Silinen noktalar segmentlerde işaretli kalır ve aramayı yavaşlatır. Optimizer ayarlarının
+        # güncellenmesi Qdrant'ın optimizer'larını uyandırır; eşiği aşan segmentler arka planda vacuum edilir
+        client = self.client()
+        client.update_collection(
+            self.collection_name,
+            optimizers_config=models.OptimizersConfigDiff(
+                deleted_threshold=QDRANT_VACUUM_DELETED_THRESHOLD,
+                vacuum_min_vector_number=QDRANT_VACUUM_MIN_VECTORS,
+            ),
+        )
+        info = client.get_collection(self.collection_name)
+        return {"status": getattr(info.status, "value", info.status), "points": info.points_count,
+                "segments": info.segments_count}
+
+    def health_check(self) -> bool:
+        try:
+            self.client().get_collections()
+            self.healthy = True
+        except Exception as e:
+            print(f"⚠️  Qdrant sağlık kontrolü başarısız: {e}")
+            self.healthy = False
+            self.reconnect()
+        return self.healthy
+
+    def start_health_checks(self):
+        if self._checker is not None:
+            return
+        def loop():
+            while True:
+                time.sleep(QDRANT_HEALTH_CHECK_INTERVAL)
+                self.health_check()
+        self._checker = threading.Thread(target=loop, daemon=True, name="qdrant-health")
+        self._checker.start()